@@ -0,0 +1,93 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Shared store for generated files (invoice/statement PDFs, exports). Blobs live on disk and sessions hold only
+# a short handle, so an idle tab costs a few bytes instead of a PDF. The store is bounded by total size (least
+# recently used first out) and by age; a handle that has been evicted simply reads back as None.
+
+class ArtifactStore:
+    def __init__(self, root, max_bytes, ttl):
+        self.root, self.max_bytes, self.ttl = root, max_bytes, ttl
+        # Files left by a previous server process have no handles pointing at them any more.
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.items = OrderedDict()  # handle -> {"path", "size", "name", "mime", "created"}
+        self.total = 0
+        self.evicted = 0
+
+    def put(self, data, name, mime):
+        handle = uuid.uuid4().hex
+        path = os.path.join(self.root, handle)
+        with open(path, "wb") as f: f.write(data)
+        return self._register(handle, path, name, mime)
+
+    def put_file(self, src_path, name, mime):
+        # Takes ownership of an already-written file (e.g. a streamed export) without reading it into memory.
+        handle = uuid.uuid4().hex
+        path = os.path.join(self.root, handle)
+        shutil.move(src_path, path)
+        return self._register(handle, path, name, mime)
+
+    def _register(self, handle, path, name, mime):
+        size = os.path.getsize(path)
+        with self.lock:
+            self.items[handle] = {"path": path, "size": size, "name": name, "mime": mime, "created": time.time()}
+            self.total += size
+            self._evict()
+        return handle
+
+    def info(self, handle):
+        # (name, mime) without reading the blob, or None when it expired or was evicted.
+        with self.lock:
+            self._evict()
+            meta = self.items.get(handle) if handle else None
+            return (meta["name"], meta["mime"]) if meta else None
+
+    def get(self, handle):
+        # Returns (data, name, mime) or None when the artifact expired or was evicted.
+        with self.lock:
+            self._evict()
+            meta = self.items.get(handle) if handle else None
+            if meta is None: return None
+            self.items.move_to_end(handle)
+        try:
+            with open(meta["path"], "rb") as f: return f.read(), meta["name"], meta["mime"]
+        except OSError: return None
+
+    def discard(self, handle):
+        with self.lock:
+            if handle in self.items: self._drop(handle)
+
+    def _drop(self, handle):
+        meta = self.items.pop(handle)
+        self.total -= meta["size"]
+        try: os.unlink(meta["path"])
+        except OSError: pass
+
+    def _evict(self):
+        cutoff = time.time() - self.ttl
+        for handle in [h for h, m in self.items.items() if m["created"] < cutoff]:
+            self._drop(handle); self.evicted += 1
+        while self.total > self.max_bytes and len(self.items) > 1:
+            self._drop(next(iter(self.items))); self.evicted += 1
+
+    @staticmethod
+    def remove_stale_roots(parent):
+        # Per-process roots (named by PID) whose process is gone: nothing can reach their files any more.
+        try: names = os.listdir(parent)
+        except OSError: return
+        for name in names:
+            if not name.isdigit() or int(name) == os.getpid(): continue
+            try: os.kill(int(name), 0)
+            except ProcessLookupError: shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+            except OSError: pass
+
+    def snapshot(self):
+        with self.lock:
+            return {"Artifacts": len(self.items), "Stored MB": round(self.total / 2**20, 1), "Limit MB": round(self.max_bytes / 2**20, 1),
+                    "TTL min": round(self.ttl / 60), "Evicted": self.evicted}
@@ -0,0 +1,197 @@
+import json
+from sqlalchemy import text
+from ar_money import cents_sql
+
+# Append-only ledger event log with incrementally maintained projections.
+# Every app write to projects/invoices/payments records an event in the same transaction and applies it
+# to the proj_* tables, so the dashboard and admin pages read precomputed numbers instead of scanning the
+# base tables. The projections can always be rebuilt from ledger_events with rebuild_projections().
+# Other apps on the shared schema (BalanceBuild Pro) write the base tables without logging events, so
+# reconcile_from_base() logs whatever the base tables have that the log lacks and recomputes the money
+# projections from the base tables. It also serves as the first-run backfill: `python ar_jobs.py projections`.
+# Between runs, sync_tenant() catches up one tenant's new rows whenever the dashboard recomputes its totals.
+
+# Held exclusively by a full reconcile and shared by per-tenant syncs (transaction-scoped advisory locks),
+# so syncs run side by side but never against a reconcile that is rewriting every tenant's projections.
+EVENTS_LOCK = "ar_events"
+
+EVENTS_DDL = [
+    '''CREATE TABLE IF NOT EXISTS ledger_events (
+        id BIGSERIAL PRIMARY KEY, user_id INTEGER NOT NULL, project_id INTEGER, entity_id INTEGER,
+        event_type TEXT NOT NULL, amount_cents BIGINT DEFAULT 0, event_date DATE, payload JSONB DEFAULT '{}',
+        created_at TIMESTAMPTZ DEFAULT now()
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_ledger_events_user ON ledger_events (user_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_ledger_events_project ON ledger_events (project_id)",
+    "CREATE INDEX IF NOT EXISTS idx_ledger_events_entity ON ledger_events (entity_id, event_type)",
+    '''CREATE TABLE IF NOT EXISTS proj_project_balances (
+        project_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, contract_cents BIGINT DEFAULT 0,
+        invoiced_cents BIGINT DEFAULT 0, collected_cents BIGINT DEFAULT 0, invoice_count INTEGER DEFAULT 0,
+        is_archived INTEGER DEFAULT 0, last_event_id BIGINT
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_proj_project_balances_user ON proj_project_balances (user_id)",
+    # Money totals cover active (non-archived) projects; invoice_count covers every live project.
+    '''CREATE TABLE IF NOT EXISTS proj_tenant_totals (
+        user_id INTEGER PRIMARY KEY, contract_cents BIGINT DEFAULT 0, invoiced_cents BIGINT DEFAULT 0,
+        collected_cents BIGINT DEFAULT 0, invoice_count INTEGER DEFAULT 0
+    )''',
+    '''CREATE TABLE IF NOT EXISTS proj_user_activity_daily (
+        user_id INTEGER NOT NULL, day DATE NOT NULL, projects INTEGER DEFAULT 0, invoices INTEGER DEFAULT 0,
+        payments INTEGER DEFAULT 0, PRIMARY KEY (user_id, day)
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_proj_user_activity_day ON proj_user_activity_daily (day)",
+]
+
+ACTIVITY_COLUMNS = {"project.created": "projects", "invoice.created": "invoices", "payment.created": "payments"}
+
+def init_events(conn):
+    # Tables only; seeding the log from an existing database is a job (reconcile_from_base), not an app start.
+    for ddl in EVENTS_DDL: conn.execute(text(ddl))
+
+def log_missing_events(conn, user_id=None, source="reconciled"):
+    # Appends the events the base tables imply but the log lacks (rows written by other apps or before the
+    # log existed); returns how many were logged. Idempotent: a second run logs nothing.
+    and_user = "" if user_id is None else "AND {}.user_id = :uid"
+    params = {"uid": user_id, "payload": json.dumps({source: True})}
+    insert = "INSERT INTO ledger_events (user_id, project_id, entity_id, event_type, amount_cents, event_date, payload)"
+    logged = conn.execute(text(f'''{insert}
+        SELECT p.user_id, p.id, p.id, 'project.created', {cents_sql('p.quoted_price')}, p.start_date, CAST(:payload AS JSONB)
+        FROM projects p WHERE p.user_id IS NOT NULL {and_user.format("p")}
+          AND NOT EXISTS (SELECT 1 FROM ledger_events e WHERE e.entity_id = p.id AND e.event_type = 'project.created')
+        ORDER BY p.id'''), params).rowcount
+    logged += conn.execute(text(f'''{insert}
+        SELECT i.user_id, i.project_id, i.id, 'invoice.created', {cents_sql('i.amount')}, i.issue_date, CAST(:payload AS JSONB)
+        FROM invoices i JOIN projects p ON p.id = i.project_id WHERE i.user_id IS NOT NULL {and_user.format("i")}
+          AND NOT EXISTS (SELECT 1 FROM ledger_events e WHERE e.entity_id = i.id AND e.event_type = 'invoice.created')
+        ORDER BY i.id'''), params).rowcount
+    logged += conn.execute(text(f'''{insert}
+        SELECT pay.user_id, pay.project_id, pay.id, 'payment.created', {cents_sql('pay.amount')}, pay.payment_date, CAST(:payload AS JSONB)
+        FROM payments pay JOIN projects p ON p.id = pay.project_id WHERE pay.user_id IS NOT NULL {and_user.format("pay")}
+          AND NOT EXISTS (SELECT 1 FROM ledger_events e WHERE e.entity_id = pay.id AND e.event_type = 'payment.created')
+        ORDER BY pay.id'''), params).rowcount
+    # Archive state: log a transition wherever the latest archived/restored event disagrees with projects.is_archived.
+    logged += conn.execute(text(f'''{insert}
+        SELECT p.user_id, p.id, p.id, s.event_type, 0, NULL, CAST(:payload AS JSONB)
+        FROM projects p
+        CROSS JOIN LATERAL (SELECT CASE WHEN p.is_archived = 1 THEN 'project.archived' ELSE 'project.restored' END AS event_type) s
+        LEFT JOIN LATERAL (SELECT e.event_type FROM ledger_events e WHERE e.project_id = p.id
+                           AND e.event_type IN ('project.archived', 'project.restored') ORDER BY e.id DESC LIMIT 1) last ON true
+        WHERE p.user_id IS NOT NULL {and_user.format("p")} AND s.event_type <> coalesce(last.event_type, 'project.restored')
+        ORDER BY p.id'''), params).rowcount
+    logged += conn.execute(text(f'''{insert}
+        SELECT e.user_id, e.project_id, e.project_id, 'project.deleted', 0, NULL, CAST(:payload AS JSONB)
+        FROM ledger_events e
+        WHERE e.event_type = 'project.created' {and_user.format("e")}
+          AND NOT EXISTS (SELECT 1 FROM projects p WHERE p.id = e.project_id)
+          AND NOT EXISTS (SELECT 1 FROM ledger_events d WHERE d.project_id = e.project_id AND d.event_type = 'project.deleted')
+        ORDER BY e.id'''), params).rowcount
+    return logged
+
+def reconcile_from_base(conn, user_id=None):
+    # Brings the log and projections in line with what is actually in projects/invoices/payments, including
+    # edits and deletes made outside this app that no event describes. Returns the number of events logged.
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:k))"), {"k": EVENTS_LOCK})
+    source = "reconciled" if conn.execute(text("SELECT EXISTS (SELECT 1 FROM ledger_events)")).scalar() else "backfill"
+    logged = log_missing_events(conn, user_id, source=source)
+    rebuild_projections(conn, user_id, from_base=True)
+    return logged
+
+def sync_tenant(conn, user_id):
+    # Logs the rows other apps added, archived or deleted for one tenant since its last sync and, only if
+    # there were any, recomputes that tenant's projections from the base tables. Edits to existing rows made
+    # outside this app are left to the scheduled reconcile. Returns the number of events logged.
+    conn.execute(text("SELECT pg_advisory_xact_lock_shared(hashtext(:k))"), {"k": EVENTS_LOCK})
+    # Two sessions of one tenant would otherwise both log the same missing rows.
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:k), :uid)"), {"k": EVENTS_LOCK, "uid": user_id})
+    logged = log_missing_events(conn, user_id)
+    if logged: rebuild_projections(conn, user_id, from_base=True)
+    return logged
+
+def record_event(conn, user_id, event_type, project_id=None, entity_id=None, amount_cents=0, event_date=None, payload=None):
+    if project_id is None and event_type.startswith("project."): project_id = entity_id
+    event_id = conn.execute(text('''INSERT INTO ledger_events (user_id, project_id, entity_id, event_type, amount_cents, event_date, payload)
+        VALUES (:uid, :pid, :eid, :et, :amt, :dt, CAST(:payload AS JSONB)) RETURNING id'''),
+        {"uid": user_id, "pid": project_id, "eid": entity_id, "et": event_type, "amt": int(amount_cents or 0),
+         "dt": event_date, "payload": json.dumps(payload or {}, default=str)}).scalar()
+    apply_event(conn, event_id, user_id, event_type, project_id, int(amount_cents or 0), event_date)
+    return event_id
+
+def _bump_tenant(conn, user_id, contract=0, invoiced=0, collected=0, invoices=0):
+    conn.execute(text('''INSERT INTO proj_tenant_totals (user_id, contract_cents, invoiced_cents, collected_cents, invoice_count)
+        VALUES (:uid, :c, :i, :p, :n)
+        ON CONFLICT (user_id) DO UPDATE SET contract_cents = proj_tenant_totals.contract_cents + EXCLUDED.contract_cents,
+            invoiced_cents = proj_tenant_totals.invoiced_cents + EXCLUDED.invoiced_cents,
+            collected_cents = proj_tenant_totals.collected_cents + EXCLUDED.collected_cents,
+            invoice_count = proj_tenant_totals.invoice_count + EXCLUDED.invoice_count'''),
+        {"uid": user_id, "c": contract, "i": invoiced, "p": collected, "n": invoices})
+
+def apply_event(conn, event_id, user_id, event_type, project_id, amount_cents, event_date):
+    params = {"pid": project_id, "uid": user_id, "amt": amount_cents, "eid": event_id}
+    if event_type in ("project.created", "invoice.created", "payment.created"):
+        column = {"project.created": "contract_cents", "invoice.created": "invoiced_cents", "payment.created": "collected_cents"}[event_type]
+        count = 1 if event_type == "invoice.created" else 0
+        archived = conn.execute(text(f'''INSERT INTO proj_project_balances (project_id, user_id, {column}, invoice_count, last_event_id)
+            VALUES (:pid, :uid, :amt, :n, :eid)
+            ON CONFLICT (project_id) DO UPDATE SET {column} = proj_project_balances.{column} + EXCLUDED.{column},
+                invoice_count = proj_project_balances.invoice_count + EXCLUDED.invoice_count, last_event_id = EXCLUDED.last_event_id
+            RETURNING is_archived'''), {**params, "n": count}).scalar()
+        money = {"project.created": "contract", "invoice.created": "invoiced", "payment.created": "collected"}[event_type]
+        _bump_tenant(conn, user_id, invoices=count, **({money: amount_cents} if not archived else {}))
+        if event_date:
+            activity = ACTIVITY_COLUMNS[event_type]
+            conn.execute(text(f'''INSERT INTO proj_user_activity_daily (user_id, day, {activity}) VALUES (:uid, :day, 1)
+                ON CONFLICT (user_id, day) DO UPDATE SET {activity} = proj_user_activity_daily.{activity} + 1'''), {"uid": user_id, "day": event_date})
+    elif event_type in ("project.archived", "project.restored"):
+        flag = 1 if event_type == "project.archived" else 0
+        row = conn.execute(text('''UPDATE proj_project_balances SET is_archived = :flag, last_event_id = :eid
+            WHERE project_id = :pid AND is_archived <> :flag RETURNING contract_cents, invoiced_cents, collected_cents'''), {**params, "flag": flag}).first()
+        if row:
+            sign = -1 if flag else 1
+            _bump_tenant(conn, user_id, sign * row[0], sign * row[1], sign * row[2])
+    elif event_type == "project.deleted":
+        row = conn.execute(text('''DELETE FROM proj_project_balances WHERE project_id = :pid
+            RETURNING contract_cents, invoiced_cents, collected_cents, invoice_count, is_archived'''), params).first()
+        if row:
+            if row[4]: _bump_tenant(conn, user_id, invoices=-row[3])
+            else: _bump_tenant(conn, user_id, -row[0], -row[1], -row[2], -row[3])
+
+def rebuild_projections(conn, user_id=None, from_base=False):
+    # Replays ledger_events by default; from_base=True takes per-project money and archive state straight
+    # from the base tables instead (activity counts always come from the log).
+    scope = "" if user_id is None else "WHERE user_id = :uid"
+    params = {"uid": user_id}
+    for table in ("proj_project_balances", "proj_tenant_totals", "proj_user_activity_daily"):
+        conn.execute(text(f"DELETE FROM {table} {scope}"), params)
+    if from_base: conn.execute(text(f'''INSERT INTO proj_project_balances (project_id, user_id, contract_cents, invoiced_cents, collected_cents, invoice_count, is_archived, last_event_id)
+        SELECT p.id, p.user_id, {cents_sql('p.quoted_price')}, coalesce(i.cents, 0), coalesce(pay.cents, 0), coalesce(i.n, 0),
+               coalesce(p.is_archived, 0), (SELECT MAX(e.id) FROM ledger_events e WHERE e.project_id = p.id)
+        FROM projects p
+        LEFT JOIN (SELECT project_id, SUM({cents_sql('amount')}) AS cents, COUNT(*) AS n FROM invoices GROUP BY project_id) i ON i.project_id = p.id
+        LEFT JOIN (SELECT project_id, SUM({cents_sql('amount')}) AS cents FROM payments GROUP BY project_id) pay ON pay.project_id = p.id
+        WHERE p.user_id IS NOT NULL {scope.replace("user_id", "p.user_id").replace("WHERE", "AND")}'''), params)
+    else: conn.execute(text(f'''INSERT INTO proj_project_balances (project_id, user_id, contract_cents, invoiced_cents, collected_cents, invoice_count, is_archived, last_event_id)
+        SELECT e.project_id, MAX(e.user_id),
+               coalesce(SUM(e.amount_cents) FILTER (WHERE e.event_type = 'project.created'), 0),
+               coalesce(SUM(e.amount_cents) FILTER (WHERE e.event_type = 'invoice.created'), 0),
+               coalesce(SUM(e.amount_cents) FILTER (WHERE e.event_type = 'payment.created'), 0),
+               COUNT(*) FILTER (WHERE e.event_type = 'invoice.created'),
+               coalesce((array_agg(CASE WHEN e.event_type = 'project.archived' THEN 1 ELSE 0 END ORDER BY e.id DESC)
+                         FILTER (WHERE e.event_type IN ('project.archived', 'project.restored')))[1], 0),
+               MAX(e.id)
+        FROM ledger_events e
+        WHERE e.project_id IS NOT NULL {scope.replace("user_id", "e.user_id").replace("WHERE", "AND")}
+          AND NOT EXISTS (SELECT 1 FROM ledger_events d WHERE d.project_id = e.project_id AND d.event_type = 'project.deleted')
+        GROUP BY e.project_id'''), params)
+    conn.execute(text(f'''INSERT INTO proj_tenant_totals (user_id, contract_cents, invoiced_cents, collected_cents, invoice_count)
+        SELECT user_id, coalesce(SUM(contract_cents) FILTER (WHERE is_archived = 0), 0),
+               coalesce(SUM(invoiced_cents) FILTER (WHERE is_archived = 0), 0),
+               coalesce(SUM(collected_cents) FILTER (WHERE is_archived = 0), 0), SUM(invoice_count)
+        FROM proj_project_balances {scope} GROUP BY user_id'''), params)
+    conn.execute(text(f'''INSERT INTO proj_user_activity_daily (user_id, day, projects, invoices, payments)
+        SELECT user_id, event_date,
+               COUNT(*) FILTER (WHERE event_type = 'project.created'),
+               COUNT(*) FILTER (WHERE event_type = 'invoice.created'),
+               COUNT(*) FILTER (WHERE event_type = 'payment.created')
+        FROM ledger_events
+        WHERE event_date IS NOT NULL AND event_type IN ('project.created', 'invoice.created', 'payment.created') {scope.replace("WHERE", "AND")}
+        GROUP BY user_id, event_date'''), params)
@@ -0,0 +1,98 @@
+import csv
+import os
+import tempfile
+from ar_money import cents_sql, cents_to_decimal
+from ar_queries import ledger_query
+
+# Full-tenant exports for bookkeepers. Rows are streamed from a server-side cursor in chunks and
+# written straight to a CSV or write-only XLSX file, so memory stays flat however big the tenant is.
+# Every export has a native column layout and a QuickBooks Online import layout.
+
+CHUNK_ROWS = 2000
+
+def _money(cents):
+    return cents_to_decimal(cents or 0)
+
+def _qb_date(value):
+    return value.strftime("%m/%d/%Y") if value else ""
+
+EXPORTS = {
+    "projects": {
+        "sql": f"""SELECT id, name, client_name, client_email, {cents_sql('quoted_price')} AS quoted_price, start_date, duration_days, status, po_number,
+                          billing_street, billing_city, billing_state, billing_zip, is_archived
+                   FROM projects WHERE user_id = :uid ORDER BY id""",
+        "columns": ["Project ID", "Project", "Client", "Client Email", "Contract Amount", "Start Date", "Duration (Days)", "Status", "PO Number",
+                    "Billing Street", "Billing City", "Billing State", "Billing Zip", "Archived"],
+        "row": lambda r: (r.id, r.name, r.client_name, r.client_email, _money(r.quoted_price), r.start_date, r.duration_days, r.status, r.po_number,
+                          r.billing_street, r.billing_city, r.billing_state, r.billing_zip, "Yes" if r.is_archived else "No"),
+        # QuickBooks customer import: each project becomes a sub-customer "Client:Project".
+        "qb_columns": ["Name", "Company", "Email", "Billing Address Line 1", "Billing Address City", "Billing Address State",
+                       "Billing Address Postal Code", "Notes"],
+        "qb_row": lambda r: (f"{r.client_name or ''}:{r.name or ''}", r.client_name, r.client_email, r.billing_street, r.billing_city,
+                             r.billing_state, r.billing_zip, f"{r.status or ''} PO {r.po_number}" if r.po_number else r.status),
+    },
+    "invoices": {
+        "sql": f"""SELECT i.invoice_num, i.issue_date, p.name AS project, p.client_name, i.description,
+                          {cents_sql('i.amount')} AS amount, {cents_sql('i.tax')} AS tax
+                   FROM invoices i JOIN projects p ON p.id = i.project_id
+                   WHERE i.user_id = :uid AND p.user_id = :uid ORDER BY i.invoice_num, i.id""",
+        "columns": ["Invoice #", "Date", "Project", "Client", "Description", "Amount", "Tax"],
+        "row": lambda r: (r.invoice_num, r.issue_date, r.project, r.client_name, r.description, _money(r.amount), _money(r.tax)),
+        # QuickBooks invoice import: one line per invoice; stored amounts include tax, so the item line is net of it.
+        "qb_columns": ["InvoiceNo", "Customer", "InvoiceDate", "DueDate", "Terms", "Item(Product/Service)", "ItemDescription",
+                       "ItemQuantity", "ItemRate", "ItemAmount", "TaxAmount"],
+        "qb_row": lambda r: (r.invoice_num, f"{r.client_name or ''}:{r.project or ''}", _qb_date(r.issue_date), _qb_date(r.issue_date),
+                             "Due on receipt", "Progress Billing", r.description, 1, _money(r.amount - r.tax), _money(r.amount - r.tax), _money(r.tax)),
+    },
+    "payments": {
+        "sql": f"""SELECT pay.payment_date, p.name AS project, p.client_name, {cents_sql('pay.amount')} AS amount, pay.notes
+                   FROM payments pay JOIN projects p ON p.id = pay.project_id
+                   WHERE pay.user_id = :uid AND p.user_id = :uid ORDER BY pay.payment_date, pay.id""",
+        "columns": ["Date", "Project", "Client", "Amount", "Notes"],
+        "row": lambda r: (r.payment_date, r.project, r.client_name, _money(r.amount), r.notes),
+        "qb_columns": ["Date", "Customer", "Reference No", "Amount", "Memo"],
+        "qb_row": lambda r: (_qb_date(r.payment_date), f"{r.client_name or ''}:{r.project or ''}", r.notes, _money(r.amount), r.notes),
+    },
+    "ledger": {
+        "sql": ledger_query("TRUE"),
+        "columns": ["Date", "Project", "Details", "Charge", "Payment", "Project Balance", "Running Balance"],
+        "row": lambda r: (r.tx_date, r.project, r.details, _money(r.charge), _money(r.payment), _money(r.project_balance), _money(r.balance)),
+        # QuickBooks three-column bank upload: positive for billings, negative for collections.
+        "qb_columns": ["Date", "Description", "Amount"],
+        "qb_row": lambda r: (_qb_date(r.tx_date), f"{r.project}: {r.details}", _money(r.charge - r.payment)),
+    },
+}
+
+def _rows(conn, kind, user_id):
+    from sqlalchemy import text
+    result = conn.execution_options(stream_results=True, yield_per=CHUNK_ROWS).execute(text(EXPORTS[kind]["sql"]), {"uid": user_id, "start": None, "end": None})
+    for chunk in result.partitions():
+        yield from chunk
+
+def write_export(db_url, kind, user_id, fmt="csv", quickbooks=False, path=None):
+    # Runs in a worker process (or from ar_jobs): opens its own connection and returns the path of the written file.
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import NullPool
+    spec = EXPORTS[kind]
+    columns, to_row = (spec["qb_columns"], spec["qb_row"]) if quickbooks else (spec["columns"], spec["row"])
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix=f"export_{kind}_", suffix=f".{fmt}"); os.close(fd)
+    engine = create_engine(db_url, poolclass=NullPool)
+    try:
+        with engine.connect() as conn:
+            if fmt == "xlsx":
+                from openpyxl import Workbook
+                wb = Workbook(write_only=True); ws = wb.create_sheet(kind.title())
+                ws.append(columns)
+                for r in _rows(conn, kind, user_id): ws.append(to_row(r))
+                wb.save(path)
+            else:
+                with open(path, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f); writer.writerow(columns)
+                    for r in _rows(conn, kind, user_id): writer.writerow(to_row(r))
+    except Exception:
+        os.unlink(path)
+        raise
+    finally:
+        engine.dispose()
+    return path
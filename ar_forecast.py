@@ -0,0 +1,67 @@
+import datetime
+import json
+import numpy as np
+import pandas as pd
+
+# Weekly cash-flow forecast for the dashboard: pure numpy over one row per active project, so it can be
+# tested without a database. The app's get_cashflow_forecast() supplies the rows and the tenant's payment lag.
+
+def parse_date_list(value):
+    try: items = json.loads(value) if isinstance(value, str) else (value or [])
+    except ValueError: return []
+    return items if isinstance(items, list) else []
+
+def spread_forecast(projs, lag, weeks, today=None):
+    # Spreads each project's unbilled contract value (quoted_price - billed, cents) evenly over its remaining
+    # working days (weekdays minus its non_working_days); projects with none left bill everything on the next
+    # business day. Collections follow billings by `lag` days, net of retainage_percent, which is released
+    # `lag` days after the project end date. Returns weekly totals in dollars starting at `today`.
+    today = np.datetime64(today or datetime.date.today(), 'D')
+    horizon = weeks * 7
+    days = today + np.arange(horizon)
+    week_starts = pd.to_datetime(days[::7])
+    empty = pd.DataFrame({'week': week_starts, 'billings': 0.0, 'collections': 0.0})
+    if projs.empty: return empty
+
+    # Spreading is fractional, so the grid works in float cents; results are converted to dollars for display.
+    unbilled = np.clip(projs['quoted_price'].astype(float).to_numpy() - projs['billed'].astype(float).to_numpy(), 0, None)
+    ret = projs['retainage_percent'].fillna(0).astype(float).to_numpy() / 100
+    start = pd.to_datetime(projs['start_date'], errors='coerce').fillna(pd.Timestamp(today)).to_numpy().astype('datetime64[D]')
+    duration = projs['duration_days'].fillna(0).astype(int).to_numpy()
+    end = start + np.maximum(duration, 1).astype('timedelta64[D]')
+    win_start = np.maximum(start, today)
+    end = np.maximum(end, win_start + np.timedelta64(1, 'D'))
+
+    # Working-day grid (projects x days) and total remaining working days per project, including beyond the horizon.
+    working = (days[None, :] >= win_start[:, None]) & (days[None, :] < end[:, None]) & np.is_busday(days)[None, :]
+    remaining = np.busday_count(win_start, end)
+    off = projs['non_working_days'].apply(parse_date_list).explode().dropna()
+    if not off.empty:
+        rows = projs.index.get_indexer(off.index)
+        off_days = pd.to_datetime(off.astype(str), errors='coerce').to_numpy().astype('datetime64[D]')
+        valid = ~np.isnat(off_days)
+        rows, off_days = rows[valid], off_days[valid]
+        in_window = (off_days >= win_start[rows]) & (off_days < end[rows]) & np.is_busday(off_days)
+        rows, off_days = rows[in_window], off_days[in_window]
+        pairs = np.unique(np.stack([rows, (off_days - today).astype(int)]), axis=1)
+        np.subtract.at(remaining, pairs[0], 1)
+        in_grid = pairs[1] < horizon
+        working[pairs[0][in_grid], pairs[1][in_grid]] = False
+
+    billings = np.zeros_like(working, dtype=float)
+    has_days = remaining > 0
+    billings[has_days] = working[has_days] * (unbilled[has_days] / remaining[has_days])[:, None]
+    # No working days left (overdue or fully blocked): expect the balance on the next business day.
+    first_bd = (np.busday_offset(win_start[~has_days], 0, roll='forward') - today).astype(int)
+    late_rows = np.flatnonzero(~has_days)[first_bd < horizon]
+    billings[late_rows, first_bd[first_bd < horizon]] = unbilled[late_rows]
+
+    collections = np.zeros_like(billings)
+    if lag < horizon: collections[:, lag:] = (billings * (1 - ret)[:, None])[:, :horizon - lag]
+    release = (end - today).astype(int) + lag
+    due = release < horizon
+    np.add.at(collections, (np.flatnonzero(due), release[due]), unbilled[due] * ret[due])
+
+    empty['billings'] = billings.sum(axis=0).reshape(weeks, 7).sum(axis=1) / 100
+    empty['collections'] = collections.sum(axis=0).reshape(weeks, 7).sum(axis=1) / 100
+    return empty
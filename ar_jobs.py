@@ -0,0 +1,391 @@
+import argparse
+import datetime
+import os
+import smtplib
+import sys
+import time
+from email.message import EmailMessage
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+import ar_events
+from ar_money import format_cents
+from ar_queries import (ledger_query, opening_balance_query, PROJECT_SEARCH_VECTOR, INVOICE_SEARCH_VECTOR, PAYMENT_SEARCH_VECTOR, SEARCH_QUERY,
+                        BILLING_TREND_QUERY, FORECAST_PROJECTS_QUERY, DAYS_TO_PAY_QUERY, NEXT_INVOICE_NUMBER_QUERY, INVOICE_HISTORY_QUERY,
+                        PAYMENT_HISTORY_QUERY, DELETE_PROJECT_QUERY)
+
+# Scheduled maintenance jobs, run outside Streamlit (cron / Render job):
+#   python ar_jobs.py rollup [--through YYYY-MM-DD] [--rebuild-projections]
+#   python ar_jobs.py projections [--user-id N]
+#   python ar_jobs.py statements [--period YYYY-MM] [--rate 60] [--user-id N] [--dry-run]
+#   python ar_jobs.py export --user-id N --kind ledger --format xlsx [--quickbooks] --out ledger.xlsx
+#   python ar_jobs.py indexes
+#   python ar_jobs.py partition [--partitions 16] [--explain-user-id N]
+# Connects with the same SUPABASE_DB_URL environment variable as the app. Statement mail goes to
+# SMTP_HOST:SMTP_PORT (default localhost:1025, i.e. a local debugging server such as
+# `python -m aiosmtpd -n -l localhost:1025`), with optional SMTP_USER / SMTP_PASSWORD / SMTP_STARTTLS / SMTP_FROM.
+
+ROLLUP_DDL = [
+    '''CREATE TABLE IF NOT EXISTS referral_daily (
+        referral_code TEXT NOT NULL, day DATE NOT NULL, signups INTEGER DEFAULT 0, PRIMARY KEY (referral_code, day)
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_referral_daily_day ON referral_daily (day)",
+    '''CREATE TABLE IF NOT EXISTS rollup_watermarks (
+        job TEXT PRIMARY KEY, through_day DATE, updated_at TIMESTAMPTZ DEFAULT now()
+    )''',
+    # users.created_at is ISO 'YYYY-MM-DD' text, so a plain btree serves the "since watermark" range.
+    "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_users_referred_by ON users (referred_by)",
+]
+
+# Signup day from the text column; legacy values that are not dates land on a fixed day so lifetime totals still count them.
+SIGNUP_DAY = "coalesce(CASE WHEN created_at ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}' THEN LEFT(created_at, 10)::date END, DATE '1970-01-01')"
+
+STATEMENTS_DDL = [
+    # One row per statement actually sent; the primary key makes reruns of a period skip delivered clients.
+    '''CREATE TABLE IF NOT EXISTS statement_deliveries (
+        user_id INTEGER NOT NULL, client_name TEXT NOT NULL, period TEXT NOT NULL, email TEXT,
+        balance_cents BIGINT, sent_at TIMESTAMPTZ DEFAULT now(), PRIMARY KEY (user_id, client_name, period)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS statement_dead_letters (
+        id BIGSERIAL PRIMARY KEY, user_id INTEGER NOT NULL, client_name TEXT, period TEXT, email TEXT,
+        attempts INTEGER, error TEXT, failed_at TIMESTAMPTZ DEFAULT now()
+    )''',
+]
+
+def init_job_tables(conn):
+    for ddl in ROLLUP_DDL + STATEMENTS_DDL: conn.execute(text(ddl))
+
+def day_bound(day):
+    # Text upper bound for everything stamped on `day`: '~' sorts after any time suffix on an ISO date string.
+    return f"{day.isoformat()}~"
+
+def get_watermark(conn, job):
+    return conn.execute(text("SELECT through_day FROM rollup_watermarks WHERE job = :job"), {"job": job}).scalar()
+
+def rollup_referrals(conn, through=None):
+    # Folds signups created after the last watermark, up to and including `through` (default: yesterday), into referral_daily.
+    # Rows are partitioned by comparing the ISO text, matching the "today's delta" read in the admin page exactly.
+    through = through or (datetime.date.today() - datetime.timedelta(days=1))
+    start = get_watermark(conn, "referral_daily")
+    if start and start >= through: return 0
+    where = "referred_by IS NOT NULL AND referred_by <> '' AND coalesce(created_at, '') <= :through"
+    if start: where += " AND coalesce(created_at, '') > :start"
+    rows = conn.execute(text(f'''INSERT INTO referral_daily (referral_code, day, signups)
+        SELECT referred_by, {SIGNUP_DAY}, COUNT(*) FROM users WHERE {where} GROUP BY 1, 2
+        ON CONFLICT (referral_code, day) DO UPDATE SET signups = referral_daily.signups + EXCLUDED.signups'''),
+        {"through": day_bound(through), "start": day_bound(start) if start else None}).rowcount
+    conn.execute(text('''INSERT INTO rollup_watermarks (job, through_day, updated_at) VALUES ('referral_daily', :through, now())
+        ON CONFLICT (job) DO UPDATE SET through_day = EXCLUDED.through_day, updated_at = EXCLUDED.updated_at'''), {"through": through})
+    return rows
+
+def get_jobs_engine():
+    db_url = os.environ.get("SUPABASE_DB_URL")
+    if not db_url: sys.exit("SUPABASE_DB_URL is not set")
+    if db_url.startswith("postgres://"): db_url = db_url.replace("postgres://", "postgresql://", 1)
+    return create_engine(db_url, poolclass=NullPool)
+
+# --- STATEMENT DELIVERY ---
+class PermanentDeliveryError(Exception):
+    def __init__(self, message, attempts):
+        super().__init__(message)
+        self.attempts = attempts
+
+class SMTPSender:
+    # One SMTP connection reused for every message (reopened after errors or every `recycle` messages),
+    # paced to at most `rate` messages per minute, with exponential-backoff retries for transient failures.
+    def __init__(self, host, port, user=None, password=None, starttls=False, rate=60, retries=3, backoff=1.0, recycle=200):
+        if retries < 1: raise ValueError("retries must be at least 1")
+        self.host, self.port, self.user, self.password, self.starttls = host, port, user, password, starttls
+        self.interval = 60.0 / rate if rate else 0.0
+        self.retries, self.backoff, self.recycle = retries, backoff, recycle
+        self.conn, self.sent_on_conn, self.last_sent = None, 0, 0.0
+
+    def _connect(self):
+        self.close()
+        self.conn = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.starttls: self.conn.starttls()
+        if self.user: self.conn.login(self.user, self.password)
+        self.sent_on_conn = 0
+
+    def close(self):
+        if self.conn:
+            try: self.conn.quit()
+            except Exception: pass
+        self.conn = None
+
+    def send(self, msg):
+        # Returns the number of attempts used; raises PermanentDeliveryError once retries are exhausted.
+        for attempt in range(1, self.retries + 1):
+            wait = self.last_sent + self.interval - time.monotonic()
+            if wait > 0: time.sleep(wait)
+            try:
+                if self.conn is None or self.sent_on_conn >= self.recycle: self._connect()
+                self.conn.send_message(msg)
+                self.sent_on_conn += 1; self.last_sent = time.monotonic()
+                return attempt
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+                raise PermanentDeliveryError(str(e), attempt)
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code >= 500: raise PermanentDeliveryError(f"{e.smtp_code} {e.smtp_error!r}", attempt)
+                error = e
+            except (smtplib.SMTPException, OSError) as e:
+                error = e
+            self.close()
+            if attempt < self.retries: time.sleep(self.backoff * 2 ** (attempt - 1))
+        raise PermanentDeliveryError(f"{type(error).__name__}: {error}", self.retries)
+
+def statement_period(period=None):
+    # Default: the previous calendar month. Returns (label, first day, last day).
+    if period: first = datetime.datetime.strptime(period, "%Y-%m").date()
+    else: first = (datetime.date.today().replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+    last = (first.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+    return first.strftime("%Y-%m"), first, last
+
+def build_statement_message(sender_addr, tenant, client, email, period, balance, pdf_bytes):
+    company = tenant["company_name"] or tenant["username"]
+    msg = EmailMessage()
+    msg["Subject"] = f"Statement from {company} - {period}"
+    msg["From"] = sender_addr
+    msg["To"] = email
+    if tenant["email"]: msg["Reply-To"] = tenant["email"]
+    msg.set_content(f"Hello {client},\n\nPlease find attached your account statement for {period}.\n"
+                    f"Balance due: {format_cents(balance)}\n\nThank you,\n{company}\n")
+    msg.add_attachment(pdf_bytes, maintype="application", subtype="pdf", filename=f"Statement_{client}_{period}.pdf")
+    return msg
+
+def cmd_statements(args):
+    import pandas as pd
+    import ar_pdf
+    period, _, period_end = statement_period(args.period)
+    engine = get_jobs_engine()
+    with engine.begin() as conn: init_job_tables(conn)
+    sender = SMTPSender(os.environ.get("SMTP_HOST", "localhost"), int(os.environ.get("SMTP_PORT", "1025")),
+                        os.environ.get("SMTP_USER"), os.environ.get("SMTP_PASSWORD"), os.environ.get("SMTP_STARTTLS") == "1",
+                        rate=args.rate, retries=args.retries, backoff=args.backoff)
+    sender_addr = os.environ.get("SMTP_FROM", "statements@progressbill.local")
+    tenant_sql = "SELECT id, username, email, company_name, company_address, logo_data FROM users WHERE subscription_status IN ('Active', 'Trial')"
+    if args.user_id: tenant_sql += " AND id = :uid"
+    counts = {"sent": 0, "skipped": 0, "zero": 0, "failed": 0}
+    started = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            tenants = conn.execute(text(tenant_sql), {"uid": args.user_id}).mappings().all()
+        for tenant in tenants:
+            uid = tenant["id"]
+            logo = bytes(tenant["logo_data"]) if tenant["logo_data"] is not None else None
+            company_info = {"name": tenant["company_name"], "address": tenant["company_address"]}
+            # Per tenant: contacts, already-delivered clients and every client's ledger (one windowed query).
+            with engine.connect() as conn:
+                contacts = dict(conn.execute(text('''SELECT client_name, MAX(client_email) FROM projects
+                    WHERE user_id = :uid AND is_archived = 0 AND coalesce(client_email, '') <> '' AND client_name IS NOT NULL
+                    GROUP BY client_name'''), {"uid": uid}).all())
+                if not contacts: continue
+                delivered = {r[0] for r in conn.execute(text("SELECT client_name FROM statement_deliveries WHERE user_id = :uid AND period = :period"), {"uid": uid, "period": period})}
+                pending = [c for c in contacts if c not in delivered]
+                counts["skipped"] += len(contacts) - len(pending)
+                if not pending: continue
+                ledgers = pd.read_sql(text(ledger_query("p.is_archived = 0 AND p.client_name = ANY(:clients)", group_by="client_name")), conn,
+                                      params={"uid": uid, "clients": pending, "start": None, "end": period_end})
+            for client, rows in ledgers.groupby("grp", sort=False):
+                balance = int(rows["balance"].iloc[-1])
+                if balance <= 0 and not args.include_zero: counts["zero"] += 1; continue
+                projects = rows["project"].unique()
+                ledger_df = pd.DataFrame({"Date": rows["tx_date"], "Charge": rows["charge"], "Payment": rows["payment"], "Balance": rows["balance"],
+                                          "Details": rows["details"] if len(projects) == 1 else rows["project"] + ": " + rows["details"]})
+                pdf_bytes = ar_pdf.generate_statement_pdf(ledger_df, logo, company_info, ", ".join(projects), client)
+                email = contacts[client]
+                if args.dry_run: counts["sent"] += 1; continue
+                msg = build_statement_message(sender_addr, tenant, client, email, period, balance, pdf_bytes)
+                try:
+                    sender.send(msg)
+                    with engine.begin() as conn:
+                        conn.execute(text('''INSERT INTO statement_deliveries (user_id, client_name, period, email, balance_cents)
+                            VALUES (:uid, :client, :period, :email, :bal) ON CONFLICT DO NOTHING'''),
+                            {"uid": uid, "client": client, "period": period, "email": email, "bal": balance})
+                    counts["sent"] += 1
+                except PermanentDeliveryError as e:
+                    with engine.begin() as conn:
+                        conn.execute(text('''INSERT INTO statement_dead_letters (user_id, client_name, period, email, attempts, error)
+                            VALUES (:uid, :client, :period, :email, :attempts, :error)'''),
+                            {"uid": uid, "client": client, "period": period, "email": email, "attempts": e.attempts, "error": str(e)[:1000]})
+                    counts["failed"] += 1
+    finally:
+        sender.close()
+    elapsed = time.perf_counter() - started
+    rate = counts["sent"] / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"statements {period}: {counts['sent']} {'rendered' if args.dry_run else 'sent'}, {counts['skipped']} already delivered, "
+          f"{counts['zero']} zero balance, {counts['failed']} dead-lettered in {elapsed:.1f}s ({rate:.1f} statements/min)")
+
+def cmd_export(args):
+    import ar_export
+    started = time.perf_counter()
+    db_url = get_jobs_engine().url.render_as_string(hide_password=False)
+    path = ar_export.write_export(db_url, args.kind, args.user_id, args.format, args.quickbooks, args.out)
+    print(f"{args.kind} export written to {path} ({os.path.getsize(path):,} bytes) in {time.perf_counter() - started:.1f}s")
+
+# --- TENANT & SEARCH INDEXES ---
+# Every page filters by user_id; the GIN indexes back search_records() (SEARCH_QUERY) and must match
+# its expressions exactly. Built CONCURRENTLY so writers are not blocked while a large table is indexed.
+APP_INDEXES = {
+    "idx_projects_user": ("projects", "(user_id)"),
+    "idx_invoices_user": ("invoices", "(user_id)"),
+    "idx_payments_user": ("payments", "(user_id)"),
+    "idx_projects_fts": ("projects", f"USING GIN ({PROJECT_SEARCH_VECTOR.format(t='')})"),
+    "idx_invoices_fts": ("invoices", f"USING GIN ({INVOICE_SEARCH_VECTOR.format(t='')})"),
+    "idx_payments_fts": ("payments", f"USING GIN ({PAYMENT_SEARCH_VECTOR.format(t='')})"),
+}
+
+def build_indexes(engine):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction block, so each statement autocommits. A build that
+    # failed part way leaves an INVALID index that IF NOT EXISTS would skip; drop and rebuild those.
+    # Partitioned tables get their indexes from partition_table() (CONCURRENTLY does not apply to them).
+    built = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, (table, definition) in APP_INDEXES.items():
+            if is_partitioned(conn, table): continue
+            valid = conn.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:n)"), {"n": name}).scalar()
+            if valid: continue
+            if valid is False: conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}"))
+            built.append(name)
+    return built
+
+def cmd_indexes(args):
+    started = time.perf_counter()
+    built = build_indexes(get_jobs_engine())
+    print(f"indexes: built {', '.join(built) if built else 'nothing (all present)'} in {time.perf_counter() - started:.1f}s")
+
+# --- TENANT PARTITIONING ---
+PARTITIONED_TABLES = {"invoices": INVOICE_SEARCH_VECTOR, "payments": PAYMENT_SEARCH_VECTOR}
+
+def is_partitioned(conn, table):
+    return conn.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}).scalar() or False
+
+def partition_table(conn, table, partitions):
+    # Rebuilds `table` as HASH(user_id) partitions in one transaction: copy, swap, drop.
+    # The primary key becomes (id, user_id) (it must contain the partition key) and ids keep coming from the
+    # existing sequence. Rows the new constraints would reject (no user_id, or a project that no longer exists)
+    # are kept in {table}_orphans rather than dropped.
+    if is_partitioned(conn, table): return None
+    conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    orphan = f"user_id IS NULL OR (project_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM projects p WHERE p.id = {table}.project_id))"
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_orphans (LIKE {table} INCLUDING DEFAULTS)"))
+    orphans = conn.execute(text(f"INSERT INTO {table}_orphans SELECT * FROM {table} WHERE {orphan}")).rowcount
+    conn.execute(text(f"CREATE TABLE {table}_part (LIKE {table} INCLUDING DEFAULTS) PARTITION BY HASH (user_id)"))
+    conn.execute(text(f"ALTER TABLE {table}_part ADD CONSTRAINT {table}_part_pkey PRIMARY KEY (id, user_id)"))
+    for i in range(partitions):
+        conn.execute(text(f"CREATE TABLE {table}_p{i} PARTITION OF {table}_part FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"))
+    copied = conn.execute(text(f"INSERT INTO {table}_part SELECT * FROM {table} WHERE NOT ({orphan})")).rowcount
+    # The old table owns the id sequence; hand it over before dropping, or the sequence goes with it.
+    seq = conn.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": table}).scalar()
+    if seq: conn.execute(text(f"ALTER SEQUENCE {seq} OWNED BY {table}_part.id"))
+    conn.execute(text(f"DROP TABLE {table}"))
+    conn.execute(text(f"ALTER TABLE {table}_part RENAME TO {table}"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME CONSTRAINT {table}_part_pkey TO {table}_pkey"))
+    conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {table}_project_cascade_fk FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE"))
+    # Same index names and columns as APP_INDEXES, so build_indexes() sees them. idx_{table}_project stays on
+    # (project_id) alone: the cascade from projects looks rows up by project_id without a user_id. App queries lead
+    # with user_id, so they get their own composite index.
+    conn.execute(text(f"CREATE INDEX idx_{table}_user ON {table} (user_id)"))
+    conn.execute(text(f"CREATE INDEX idx_{table}_project ON {table} (project_id)"))
+    conn.execute(text(f"CREATE INDEX idx_{table}_user_project ON {table} (user_id, project_id)"))
+    conn.execute(text(f"CREATE INDEX idx_{table}_fts ON {table} USING GIN ({PARTITIONED_TABLES[table].format(t='')})"))
+    return copied, orphans
+
+def tenant_queries():
+    # Every app and job query that reads invoices or payments for one tenant, as label -> (sql, extra params).
+    # All take :uid; the defaults below fill in the rest. The project delete is a write, so it is only EXPLAINed.
+    from ar_export import EXPORTS
+    queries = {"ledger (project)": (ledger_query("p.id = :pid"), {}),
+               "ledger (client)": (ledger_query("p.client_name = :client", group_by="client_name"), {}),
+               "opening balance": (opening_balance_query("p.client_name = :client"), {}),
+               "billing trend": (BILLING_TREND_QUERY, {"grain": "month"}),
+               "search": (SEARCH_QUERY, {"term": "progress payment", "lim": 50}),
+               "invoice history": (INVOICE_HISTORY_QUERY, {}),
+               "payment history": (PAYMENT_HISTORY_QUERY, {}),
+               "next invoice number": (NEXT_INVOICE_NUMBER_QUERY, {}),
+               "forecast projects": (FORECAST_PROJECTS_QUERY, {}),
+               "forecast days-to-pay": (DAYS_TO_PAY_QUERY, {}),
+               "project delete": (DELETE_PROJECT_QUERY, {})}
+    queries.update({f"export {kind}": (spec["sql"], {}) for kind, spec in EXPORTS.items() if kind != "projects"})
+    return queries
+
+QUERY_DEFAULTS = {"pid": 0, "client": "", "start": None, "end": None}
+
+def explain_pruning(conn, user_id, partitions):
+    # Plans each tenant query and counts how many partitions it would touch.
+    for label, (sql, params) in tenant_queries().items():
+        plan = "\n".join(r[0] for r in conn.execute(text(f"EXPLAIN {sql}"), {**QUERY_DEFAULTS, "uid": user_id, **params}))
+        touched = {f"{t}_p{i}" for t in PARTITIONED_TABLES for i in range(partitions) if f" {t}_p{i} " in plan + " "}
+        print(f"{label}: {len(touched)} partition(s) scanned {sorted(touched)}")
+
+def cmd_partition(args):
+    started = time.perf_counter()
+    engine = get_jobs_engine()
+    for table in PARTITIONED_TABLES:
+        with engine.begin() as conn:
+            result = partition_table(conn, table, args.partitions)
+        if result is None: print(f"{table}: already partitioned")
+        else: print(f"{table}: {result[0]:,} rows copied into {args.partitions} hash partitions, {result[1]:,} orphans kept in {table}_orphans")
+    with engine.begin() as conn:
+        for table in PARTITIONED_TABLES: conn.execute(text(f"ANALYZE {table}"))
+        if args.explain_user_id is not None: explain_pruning(conn, args.explain_user_id, args.partitions)
+    print(f"done in {time.perf_counter() - started:.1f}s")
+
+def cmd_projections(args):
+    # First run after deploy seeds ledger_events from the base tables; later runs pick up edits and deletes
+    # made by other apps on the shared schema, which the dashboard's per-tenant sync does not see.
+    started = time.perf_counter()
+    with get_jobs_engine().begin() as conn:
+        ar_events.init_events(conn)
+        logged = ar_events.reconcile_from_base(conn, args.user_id)
+    print(f"projections: reconciled with base tables, {logged:,} missing events logged in {time.perf_counter() - started:.1f}s")
+
+def cmd_rollup(args):
+    through = datetime.date.fromisoformat(args.through) if args.through else None
+    started = time.perf_counter()
+    with get_jobs_engine().begin() as conn:
+        init_job_tables(conn)
+        rows = rollup_referrals(conn, through)
+        logged = ar_events.reconcile_from_base(conn) if args.rebuild_projections else None
+    print(f"referral_daily: {rows} day rows upserted in {time.perf_counter() - started:.1f}s")
+    if logged is not None: print(f"projections: reconciled with base tables, {logged} missing events logged")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ProgressBill Pro scheduled jobs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rollup = sub.add_parser("rollup", help="Nightly admin analytics rollup")
+    p_rollup.add_argument("--through", help="Last day to fold in (YYYY-MM-DD, default yesterday)")
+    p_rollup.add_argument("--rebuild-projections", action="store_true", help="Also reconcile ledger_events and the projection tables with the base tables (picks up other apps' writes)")
+    p_rollup.set_defaults(func=cmd_rollup)
+    p_proj = sub.add_parser("projections", help="Backfill / reconcile ledger_events and the projection tables with the base tables")
+    p_proj.add_argument("--user-id", type=int, help="Only this tenant")
+    p_proj.set_defaults(func=cmd_projections)
+    p_stmt = sub.add_parser("statements", help="Email month-end client statements")
+    p_stmt.add_argument("--period", help="Statement month (YYYY-MM, default last month)")
+    p_stmt.add_argument("--user-id", type=int, help="Only this tenant")
+    p_stmt.add_argument("--rate", type=float, default=60, help="Max messages per minute (0 = unlimited)")
+    p_stmt.add_argument("--retries", type=int, default=3, help="Send attempts before dead-lettering")
+    p_stmt.add_argument("--backoff", type=float, default=1.0, help="Initial retry delay in seconds (doubles per attempt)")
+    p_stmt.add_argument("--include-zero", action="store_true", help="Also send statements with nothing outstanding")
+    p_stmt.add_argument("--dry-run", action="store_true", help="Build and render statements without sending")
+    p_stmt.set_defaults(func=cmd_statements)
+    p_export = sub.add_parser("export", help="Stream a full tenant export to CSV/XLSX")
+    p_export.add_argument("--user-id", type=int, required=True)
+    p_export.add_argument("--kind", choices=["invoices", "payments", "projects", "ledger"], required=True)
+    p_export.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+    p_export.add_argument("--quickbooks", action="store_true", help="QuickBooks Online import column layout")
+    p_export.add_argument("--out", help="Output path (default: a temp file)")
+    p_export.set_defaults(func=cmd_export)
+    p_idx = sub.add_parser("indexes", help="Build the tenant and full-text search indexes without blocking writes")
+    p_idx.set_defaults(func=cmd_indexes)
+    p_part = sub.add_parser("partition", help="Migrate invoices/payments to HASH(user_id) partitions (takes an exclusive lock while copying)")
+    p_part.add_argument("--partitions", type=int, default=16)
+    p_part.add_argument("--explain-user-id", type=int, help="Afterwards, EXPLAIN the shared report queries for this tenant and report partitions scanned")
+    p_part.set_defaults(func=cmd_partition)
+    args = parser.parse_args(argv)
+    if args.command == "statements" and args.retries < 1: parser.error("--retries must be at least 1")
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,36 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import datetime
+import json
 import random
 import string
-import stripe 
 import os
-import tempfile
 import bcrypt  
-import altair as alt 
 import time
-import matplotlib.pyplot as plt
-import matplotlib
-import io
-from PIL import Image
-from fpdf import FPDF
+import hmac
+import hashlib
+import importlib.util
+import threading
+import tempfile
+import sys
 from sqlalchemy import create_engine, text
 from sqlalchemy.pool import NullPool
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import streamlit.components.v1 as components 
+from ar_money import to_cents, cents_to_decimal, format_cents, cents_sql
+from ar_queries import (ledger_query, opening_balance_query, SEARCH_QUERY, BILLING_TREND_QUERY, FORECAST_PROJECTS_QUERY, DAYS_TO_PAY_QUERY,
+                        NEXT_INVOICE_NUMBER_QUERY, INVOICE_HISTORY_QUERY, PAYMENT_HISTORY_QUERY, DELETE_PROJECT_QUERY)
+from ar_artifacts import ArtifactStore
+from ar_workers import ServerBusy, make_worker_pools
+import ar_events
+import ar_forecast
+import ar_jobs
 
 # --- 1. SAFE IMPORTS ---
-try:
-    from spellchecker import SpellChecker
-    SPELLCHECK_AVAILABLE = True
-except ImportError:
-    SPELLCHECK_AVAILABLE = False
+# Heavy optional libraries (stripe, supabase, spellchecker, altair, fpdf/PIL via ar_pdf) are only
+# probed here and imported on the pages that use them, keeping cold start and reruns cheap.
+SPELLCHECK_AVAILABLE = importlib.util.find_spec("spellchecker") is not None
 
 try:
     import extra_streamlit_components as stx
@@ -31,15 +38,7 @@ try:
 except ImportError:
     COOKIE_MANAGER_AVAILABLE = False
 
-# Import Supabase Client
-try:
-    from supabase import create_client, Client
-    SUPABASE_AVAILABLE = True
-except ImportError:
-    SUPABASE_AVAILABLE = False
-
-# Set Matplotlib to non-interactive mode
-matplotlib.use('Agg')
+SUPABASE_AVAILABLE = importlib.util.find_spec("supabase") is not None
 
 # --- 2. CONFIGURATION ---
 fav_icon = "favicon.png" if os.path.exists("favicon.png") else None
@@ -72,6 +71,7 @@ if "via" in st.query_params:
 # --- 5. REWARDFUL JS (Visual & Backup) ---
 REWARDFUL_API_KEY = "48a8b0" 
 
+# Emitted on every run: Streamlit drops elements a rerun does not redraw, which would unload the tracking scripts.
 components.html(f"""
     <script async src="https://www.googletagmanager.com/gtag/js?id=G-Z6JK5NFPE3"></script>
     <script>
@@ -94,7 +94,6 @@ ADMIN_USERNAME = "admin"
 BASE_PRICE = 99.00 
 AFFILIATE_COMMISSION_PER_USER = 24.75 
 STRIPE_PRICE_LOOKUP_KEY = "pro_monthly_99" 
-BB_WATERMARK = "ProgressBill Pro | Powered by Balance & Build Consulting"
 TERMS_URL = "https://balanceandbuildconsulting.com/wp-content/uploads/2025/12/Balance-Build-Consulting-LLC_Software-as-a-Service-SaaS-Terms-of-Service-and-Privacy-Policy.pdf"
 
 # --- 3. CUSTOM CSS ---
@@ -127,14 +126,19 @@ st.markdown("""
 
 # --- 4. CONNECTIONS SETUP (STRICT CLOUD UPGRADE) ---
 if "STRIPE_SECRET_KEY" in st.secrets:
-    stripe.api_key = st.secrets["STRIPE_SECRET_KEY"]
+    STRIPE_SECRET_KEY = st.secrets["STRIPE_SECRET_KEY"]
     STRIPE_PUBLISHABLE_KEY = st.secrets.get("STRIPE_PUBLISHABLE_KEY", "")
 else:
-    stripe.api_key = os.environ.get("STRIPE_SECRET_KEY", "sk_test_fallback")
+    STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY", "sk_test_fallback")
     STRIPE_PUBLISHABLE_KEY = os.environ.get("STRIPE_PUBLISHABLE_KEY", "pk_test_fallback")
 
 @st.cache_resource
-def get_engine():
+def get_stripe():
+    import stripe
+    stripe.api_key = STRIPE_SECRET_KEY
+    return stripe
+
+def get_db_url():
     # 1. Look for the Render Environment Variable
     db_url = os.environ.get("SUPABASE_DB_URL")
     
@@ -148,45 +152,179 @@ def get_engine():
     # 3. Protocol Fix for SQLAlchemy
     if db_url.startswith("postgres://"):
         db_url = db_url.replace("postgres://", "postgresql://", 1)
-        
+    return db_url
+
+@st.cache_resource
+def get_engine():
+    db_url = get_db_url()
+    if not db_url: return None
     return create_engine(db_url, pool_pre_ping=True)
 
 engine = get_engine()
 
+# --- READ REPLICA ROUTING ---
+# Heavy report reads may go to a streaming replica (SUPABASE_REPLICA_URL). A read is routed there only when the
+# replica lags by at most REPLICA_MAX_LAG_SECONDS and has replayed the tenant's last write (read-your-writes).
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 10))
+REPLICA_STATUS_TTL = 2.0
+READ_YOUR_WRITES_SECONDS = 30
+
+def get_replica_url():
+    db_url = os.environ.get("SUPABASE_REPLICA_URL")
+    if not db_url and "connections" in st.secrets:
+        try: db_url = st.secrets["connections"]["supabase_replica"]["url"]
+        except: pass
+    if not db_url: return None
+    if db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
+    return db_url
+
+@st.cache_resource
+def get_replica_engine():
+    db_url = get_replica_url()
+    if not db_url: return None
+    # Short connect timeout: an unreachable replica should fall back to the primary, not stall page loads.
+    return create_engine(db_url, pool_pre_ping=True, connect_args={"connect_timeout": 2})
+
+replica_engine = get_replica_engine()
+
+def parse_lsn(lsn):
+    # Postgres LSN text 'X/Y' -> comparable int.
+    if not lsn: return None
+    hi, lo = lsn.split("/")
+    return (int(hi, 16) << 32) + int(lo, 16)
+
+@st.cache_resource
+def get_replica_state():
+    # Process-wide: the replica's replay position (refreshed at most every REPLICA_STATUS_TTL seconds) and,
+    # per tenant, the primary WAL position (or a fallback deadline) their last write must reach first.
+    return {"lock": threading.Lock(), "checked": 0.0, "lag": None, "lsn": None, "writes": {}}
+
+def replica_status():
+    # One session probes per TTL; the lock only claims the probe and is never held across network I/O.
+    # Everyone else (including callers that lose the try-lock) gets the last known state.
+    state = get_replica_state()
+    if time.monotonic() - state["checked"] < REPLICA_STATUS_TTL or not state["lock"].acquire(blocking=False):
+        return state["lag"], state["lsn"]
+    try:
+        if time.monotonic() - state["checked"] < REPLICA_STATUS_TTL: return state["lag"], state["lsn"]
+        state["checked"] = time.monotonic()
+    finally:
+        state["lock"].release()
+    try:
+        with replica_engine.connect() as conn:
+            lsn, lag = conn.execute(text("""SELECT pg_last_wal_replay_lsn()::text,
+                CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                     ELSE coalesce(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END""")).one()
+        state["lag"], state["lsn"] = float(lag), parse_lsn(lsn)
+    except Exception:
+        state["lag"], state["lsn"] = None, None
+    return state["lag"], state["lsn"]
+
+def use_replica():
+    if not replica_engine: return False
+    lag, replay_lsn = replica_status()
+    if lag is None or lag > REPLICA_MAX_LAG_SECONDS: return False
+    last_write = get_replica_state()["writes"].get(st.session_state.get("user_id"))
+    if last_write is None: return True
+    kind, mark = last_write
+    if kind == "lsn": return replay_lsn is not None and replay_lsn >= mark
+    return time.time() >= mark
+
+def note_write(user_id):
+    # Called after a commit: remember where the primary's WAL is so this tenant's reads stay on the primary until the replica has it.
+    if not replica_engine or not user_id: return
+    try:
+        with engine.connect() as conn: mark = ("lsn", parse_lsn(conn.execute(text("SELECT pg_current_wal_lsn()::text")).scalar()))
+    except Exception:
+        mark = ("until", time.time() + READ_YOUR_WRITES_SECONDS)
+    get_replica_state()["writes"][user_id] = mark
+
 @st.cache_resource
 def init_supabase():
     try:
         url = st.secrets.get("SUPABASE_API_URL") or os.environ.get("SUPABASE_API_URL")
         key = st.secrets.get("SUPABASE_ANON_KEY") or os.environ.get("SUPABASE_ANON_KEY")
         if url and key and SUPABASE_AVAILABLE:
+            from supabase import create_client
             return create_client(url, key)
         return None
     except:
         return None
 
-supabase = init_supabase()
 
 # --- DATABASE FUNCTIONS ---
-def run_query(query, params=None):
-    if not engine: return pd.DataFrame()
+class QueryFailed(Exception):
+    pass
+
+def run_query(query, params=None, replica=False, strict=False):
+    # replica=True marks a report read that may be served by the read replica (see use_replica).
+    # strict=True raises QueryFailed instead of returning an empty frame; st.cache_data functions use it
+    # so a transient DB error is never cached as "no data".
+    target = replica_engine if replica and use_replica() else engine
+    if not target: return pd.DataFrame()
+    started = time.perf_counter()
     try:
-        with engine.connect() as conn:
+        with target.connect() as conn:
             return pd.read_sql(text(query), conn, params=params)
     except Exception as e:
+        if target is not engine: return run_query(query, params, strict=strict)
+        if strict: raise QueryFailed(str(e)) from e
         return pd.DataFrame() 
+    finally:
+        record_query(time.perf_counter() - started)
+
+def record_query(elapsed):
+    # Cumulative per-session query count/time; shown with ?debug=1 to compare interactions.
+    stats = st.session_state.setdefault("query_stats", {"queries": 0, "ms": 0.0})
+    stats["queries"] += 1; stats["ms"] += elapsed * 1000
+
+def perf_caption(label):
+    if st.query_params.get("debug"):
+        stats = st.session_state.get("query_stats", {"queries": 0, "ms": 0.0})
+        st.caption(f"⏱️ {label} @ {datetime.datetime.now():%H:%M:%S} | session queries: {stats['queries']} ({stats['ms']:,.0f} ms)")
+
+# Per-tenant data version: cached reports take it as an argument, so any write by the tenant invalidates them.
+@st.cache_resource
+def get_tenant_versions():
+    return {}
+
+def tenant_version(user_id):
+    return get_tenant_versions().get(user_id, 0)
+
+def touch_tenant(user_id):
+    versions = get_tenant_versions()
+    versions[user_id] = versions.get(user_id, 0) + 1
 
-def execute_statement(query, params=None):
+def execute_statement(query, params=None, event=None):
+    # `event` (kwargs for ar_events.record_event) is logged and projected in the same transaction.
+    # When the statement has RETURNING id, one event is recorded per returned row with entity_id set.
     if not engine: return
     try:
         with engine.begin() as conn: 
-            conn.execute(text(query), params)
+            result = conn.execute(text(query), params)
+            if event:
+                ids = [r[0] for r in result] if result.returns_rows else [event.get("entity_id")]
+                for entity_id in ids: ar_events.record_event(conn, **{**event, "entity_id": entity_id})
     except Exception as e:
         st.error(f"Database Error: {e}")
         raise e
+    # Pin reads to the primary before bumping the tenant version, so the refetch it triggers can't hit a stale replica.
+    if st.session_state.get("user_id"): note_write(st.session_state.user_id); touch_tenant(st.session_state.user_id)
+
 
 # --- FIXED: DATABASE INITIALIZATION WITH AUTO-MIGRATION ---
+# Once per server process, not on every rerun.
+@st.cache_resource(show_spinner=False)
 def init_db():
     if not engine: return
+
+    def optional_ddl(conn, sql):
+        # A failed statement aborts the whole Postgres transaction; the savepoint confines it to this step.
+        try:
+            with conn.begin_nested(): conn.execute(text(sql))
+        except Exception: pass
+
     try:
         with engine.begin() as conn:
             # 1. USERS TABLE
@@ -226,54 +364,203 @@ def init_db():
             # If tables exist from BalanceBuild Pro but are missing AR Ledger columns, add them now.
             
             # Fix 'invoices' table missing 'amount' (This fixes your error!)
-            try: conn.execute(text("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS amount NUMERIC(14,2)"))
-            except: pass # Fallback for older Postgres
+            optional_ddl(conn, "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS amount NUMERIC(14,2)") # Fallback for older Postgres
             
             # Fix 'invoices' table missing 'amount_billed' etc (Shared Schema compatibility)
-            try: conn.execute(text("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS amount_billed NUMERIC(14,2)"))
-            except: pass
-            try: conn.execute(text("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS retainage_held NUMERIC(14,2)"))
-            except: pass
-            try: conn.execute(text("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS amount_due NUMERIC(14,2)"))
-            except: pass
+            optional_ddl(conn, "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS amount_billed NUMERIC(14,2)")
+            optional_ddl(conn, "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS retainage_held NUMERIC(14,2)")
+            optional_ddl(conn, "ALTER TABLE invoices ADD COLUMN IF NOT EXISTS amount_due NUMERIC(14,2)")
             
             # Fix 'projects' table shared schema columns
-            try: conn.execute(text("ALTER TABLE projects ADD COLUMN IF NOT EXISTS retainage_percent NUMERIC(5,2) DEFAULT 0.00"))
-            except: pass
-            try: conn.execute(text("ALTER TABLE projects ADD COLUMN IF NOT EXISTS non_working_days TEXT DEFAULT '[]'"))
-            except: pass
+            optional_ddl(conn, "ALTER TABLE projects ADD COLUMN IF NOT EXISTS retainage_percent NUMERIC(5,2) DEFAULT 0.00")
+            optional_ddl(conn, "ALTER TABLE projects ADD COLUMN IF NOT EXISTS non_working_days TEXT DEFAULT '[]'")
+            optional_ddl(conn, "ALTER TABLE projects ADD COLUMN IF NOT EXISTS client_email TEXT")
+
+            # --- TENANT & SEARCH INDEXES ---
+            # Built by `python ar_jobs.py indexes` with CREATE INDEX CONCURRENTLY, so a deploy never blocks writes
+            # to a large invoices table while its GIN index is built.
+
+            # --- PROJECT ARCHIVE & CASCADE DELETES ---
+            # Archived projects stay reportable but drop out of the hot (partial) index and every picker.
+            conn.execute(text("ALTER TABLE projects ADD COLUMN IF NOT EXISTS is_archived INTEGER DEFAULT 0"))
+            conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS session_version INTEGER DEFAULT 0"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_projects_user_active ON projects (user_id) WHERE is_archived = 0"))
+            for child in ("invoices", "payments"):
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{child}_project ON {child} (project_id)"))
+                # NOT VALID: enforce for new rows without failing on legacy orphans from the shared schema.
+                conn.execute(text(f"""DO $$ BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = '{child}'::regclass AND contype = 'f' AND confdeltype = 'c') THEN
+                        ALTER TABLE {child} ADD CONSTRAINT {child}_project_cascade_fk FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE NOT VALID;
+                    END IF;
+                END $$"""))
+
+            # --- LEDGER EVENT LOG & PROJECTIONS ---
+            ar_events.init_events(conn)
+            ar_jobs.init_job_tables(conn)
 
-    except Exception as e: 
+    except Exception as e:
+        # Re-raise so cache_resource does not remember a failed init: the next rerun tries again.
         print(f"DB Init Warning: {e}")
-        pass 
+        raise
+
+try: init_db()
+except Exception: pass  # logged above; pages degrade until the database is reachable
 
-init_db()
+# --- BACKGROUND WORKERS ---
+# CPU-heavy work (bcrypt, PDF rendering) runs on shared, bounded pools so one session's month-end
+# invoicing cannot starve everyone else's reruns. When a pool is full, callers get ServerBusy and show a retry message.
+@st.cache_resource
+def get_worker_pools():
+    return make_worker_pools()
+
+def render_pdf(fn, *args):
+    # psycopg2 hands BYTEA back as memoryview, which cannot be pickled to a worker process.
+    args = [bytes(a) if isinstance(a, memoryview) else a for a in args]
+    return get_worker_pools()["pdf"].run(fn, *args)
+
+# --- GENERATED FILES & SESSION MEMORY ---
+# Sessions keep a handle into the shared, size/TTL-bounded artifact store rather than the file bytes themselves.
+@st.cache_resource
+def get_artifact_store():
+    parent = os.environ.get("ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "progressbill_artifacts"))
+    ArtifactStore.remove_stale_roots(parent)
+    return ArtifactStore(os.path.join(parent, str(os.getpid())), int(os.environ.get("ARTIFACT_MAX_MB", 512)) * 2**20, int(os.environ.get("ARTIFACT_TTL_SECONDS", 3600)))
+
+def keep_artifact(key, data, name, mime, from_file=False):
+    store = get_artifact_store()
+    store.discard(st.session_state.get(key))
+    st.session_state[key] = store.put_file(data, name, mime) if from_file else store.put(data, name, mime)
+
+def artifact_download(key, label):
+    # The bytes are read only when the button is clicked (deferred data), so an idle tab holds no copy of the file.
+    store, handle = get_artifact_store(), st.session_state.get(key)
+    info = store.info(handle)
+    if info:
+        name, mime = info
+        st.download_button(label, lambda: (store.get(handle) or (b"",))[0], name, mime)
+    elif key in st.session_state:
+        del st.session_state[key]; st.caption("The last generated file has expired. Generate it again to download.")
+
+@st.cache_resource
+def get_session_registry():
+    return {"lock": threading.Lock(), "sessions": {}}
+
+SESSION_REGISTRY_IDLE_SECONDS = 3600
+
+def session_media_bytes(session_id):
+    # Bytes Streamlit's media manager holds for this session (images, download data served from memory).
+    # Reads private runtime structures, so it is best effort and reports 0 if they change.
+    try:
+        from streamlit.runtime import Runtime
+        mgr = Runtime.instance().media_file_mgr
+        files = mgr._storage._files_by_id
+        with mgr._lock: file_ids = list(mgr._files_by_session_and_coord.get(session_id, {}).values())
+        return sum(files[f].content_size for f in file_ids if f in files)
+    except Exception: return 0
+
+def session_footprint(session_id=None):
+    # Approximate bytes held in this session's state plus its media files, and the largest key.
+    sizes = {}
+    if session_id: sizes["(media files)"] = session_media_bytes(session_id)
+    for key, value in st.session_state.to_dict().items():
+        if isinstance(value, pd.DataFrame): sizes[key] = int(value.memory_usage(deep=True).sum())
+        elif isinstance(value, (bytes, bytearray, memoryview)): sizes[key] = len(value)
+        else: sizes[key] = sys.getsizeof(value)
+    largest = max(sizes, key=sizes.get) if sizes else ""
+    return sum(sizes.values()), largest
+
+def record_session_memory(page):
+    ctx = get_script_run_ctx()
+    if ctx is None: return
+    total, largest = session_footprint(ctx.session_id)
+    registry = get_session_registry(); now = time.time()
+    with registry["lock"]:
+        registry["sessions"][ctx.session_id] = {"User": st.session_state.get("username") or "-", "Page": page, "State KB": round(total / 1024, 1),
+                                                "Largest Key": largest, "Last Seen": now}
+        for sid in [sid for sid, r in registry["sessions"].items() if now - r["Last Seen"] > SESSION_REGISTRY_IDLE_SECONDS]:
+            del registry["sessions"][sid]
 
 # --- 5. HELPER FUNCTIONS ---
-def hash_password(password):
+def _bcrypt_hash(password):
     return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
-def check_password(password, hashed):
+def _bcrypt_check(password, hashed):
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
+def hash_password(password):
+    return get_worker_pools()["auth"].run(_bcrypt_hash, password)
+
+def check_password(password, hashed):
+    return get_worker_pools()["auth"].run(_bcrypt_check, password, hashed)
+
+@st.cache_data(ttl=300, show_spinner=False, max_entries=500)
 def get_referral_stats(my_code):
     if not my_code: return 0, 0
-    df = run_query("SELECT COUNT(*) FROM users WHERE referred_by=:code AND subscription_status IN ('Active', 'Trial')", params={"code": my_code})
+    df = run_query("SELECT COUNT(*) FROM users WHERE referred_by=:code AND subscription_status IN ('Active', 'Trial')", params={"code": my_code}, replica=True, strict=True)
     if not df.empty:
         active_count = df.iloc[0, 0]
         discount_percent = min(active_count * 10, 100)
         return active_count, discount_percent
     return 0, 0
 
-def parse_currency(value):
-    if not value: return 0.0
-    if isinstance(value, (int, float)): return float(value)
-    clean = str(value).replace('$', '').replace(',', '').strip()
-    try: return float(clean)
-    except: return 0.0
+def search_records(user_id, term, limit=50):
+    if not term or not term.strip(): return pd.DataFrame()
+    return run_query(SEARCH_QUERY, {"term": term.strip(), "uid": user_id, "lim": limit}, replica=True)
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=500)
+def get_billing_trend(user_id, grain, version):
+    # Bucketed server-side; only one row per period/status reaches pandas. Amounts are cents; `version` is the tenant cache key.
+    if grain not in ("month", "quarter"): grain = "month"
+    df = run_query(BILLING_TREND_QUERY, {"grain": grain, "uid": user_id}, replica=True, strict=True)
+    if df.empty: return df
+    df['period'] = pd.to_datetime(df['period'])
+    # Fill quiet periods so the running outstanding balance carries forward for every status.
+    grid = pd.MultiIndex.from_product([sorted(df['period'].unique()), sorted(df['status'].unique())], names=['period', 'status'])
+    df = df.set_index(['period', 'status'])[['invoiced', 'collected']].astype('int64').reindex(grid, fill_value=0).reset_index()
+    df['outstanding'] = (df['invoiced'] - df['collected']).groupby(df['status']).cumsum()
+    return df
+
+@st.cache_data(ttl=300, show_spinner=False, max_entries=500)
+def get_user_context(user_id, version):
+    df = run_query("SELECT username, email, stripe_customer_id, subscription_status, created_at, referral_code, referred_by, company_name, company_address, logo_data, terms_conditions FROM users WHERE id=:id", params={"id": user_id}, strict=True)
+    # BYTEA arrives as memoryview, which st.cache_data cannot pickle.
+    if not df.empty: df['logo_data'] = df['logo_data'].apply(lambda v: bytes(v) if v is not None else None)
+    return df
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=500)
+def get_dashboard_pdf(user_id, include_archived, version, metrics, company_name, _logo, chart_data):
+    import ar_pdf
+    return render_pdf(ar_pdf.generate_dashboard_pdf, metrics, company_name, _logo, chart_data)
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=500)
+def get_dashboard_totals(user_id, include_archived, version):
+    # Read from the event projections: one row for active totals, a per-project sum when archived are included.
+    # First log whatever other apps on the shared schema (BalanceBuild Pro) wrote for this tenant since the last sync.
+    try:
+        with engine.begin() as conn: synced = ar_events.sync_tenant(conn, user_id)
+    except Exception as err:
+        print(f"Projection sync warning: {err}"); synced = 0
+    # Projections rebuilt just now are only certain to be on the primary.
+    if include_archived:
+        res = run_query("SELECT SUM(contract_cents), SUM(invoiced_cents), SUM(collected_cents) FROM proj_project_balances WHERE user_id=:id", {"id": user_id}, replica=not synced, strict=True)
+    else:
+        res = run_query("SELECT contract_cents, invoiced_cents, collected_cents FROM proj_tenant_totals WHERE user_id=:id", {"id": user_id}, replica=not synced, strict=True)
+    if res.empty: return 0, 0, 0
+    return tuple(int(v) if pd.notna(v) else 0 for v in res.iloc[0])
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=500)
+def get_cashflow_forecast(user_id, weeks, version):
+    # Active projects' unbilled contract value and the tenant's historical days-to-pay, spread into
+    # weekly billings and collections by ar_forecast.spread_forecast().
+    projs = run_query(FORECAST_PROJECTS_QUERY, {"uid": user_id}, replica=True, strict=True)
+    lag_df = run_query(DAYS_TO_PAY_QUERY, {"uid": user_id}, replica=True, strict=True)
+    lag = lag_df.iloc[0, 0] if not lag_df.empty and pd.notna(lag_df.iloc[0, 0]) else 30
+    lag = max(int(round(float(lag))), 0)
+    return ar_forecast.spread_forecast(projs, lag, weeks)
 
-def run_spell_check(text):
-    if not SPELLCHECK_AVAILABLE or not text: return None
+@st.cache_resource
+def get_spellchecker():
+    from spellchecker import SpellChecker
     spell = SpellChecker()
     construction_words = [
         'hvac', 'pvc', 'abs', 'rebar', 'drywall', 'sheetrock', 'subfloor', 'joist', 'truss', 
@@ -282,6 +569,11 @@ def run_spell_check(text):
         'fixture', 'demolition', 'reno', 'remodel', 'permit', 'subcontractor'
     ]
     spell.word_frequency.load_words(construction_words)
+    return spell
+
+def run_spell_check(text):
+    if not SPELLCHECK_AVAILABLE or not text: return None
+    spell = get_spellchecker()
     words = spell.split_words(text)
     misspelled = spell.unknown(words)
     suggestions = {}
@@ -293,136 +585,9 @@ def run_spell_check(text):
 def metric_card(title, value, subtext=""):
     st.markdown(f"""<div class="dashboard-card"><div class="card-title">{title}</div><div class="card-value">{value}</div><div class="card-sub">{subtext}</div></div>""", unsafe_allow_html=True)
 
-def clean_text(text):
-    if not text: return ""
-    text = str(text)
-    replacements = {
-        '\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"',
-        '\u2013': '-', '\u2014': '-', '\u2026': '...', '\u00A0': ' '
-    }
-    for k, v in replacements.items(): text = text.replace(k, v)
-    return text.encode('latin-1', 'replace').decode('latin-1')
-
-class BB_PDF(FPDF):
-    def footer(self):
-        self.set_y(-15); self.set_font('Arial', 'I', 8); self.set_text_color(180, 180, 180); self.cell(0, 10, BB_WATERMARK, 0, 0, 'C')
-
-def generate_pdf_invoice(inv_data, logo_data, company_info, project_info, terms):
-    pdf = BB_PDF(); pdf.add_page(); pdf.set_auto_page_break(auto=True, margin=20)
-    if logo_data:
-        try:
-            image = Image.open(io.BytesIO(logo_data))
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                image.save(tmp, format="PNG"); tmp_path = tmp.name
-            pdf.image(tmp_path, 10, 10, 35); os.unlink(tmp_path)
-        except: pass
-    c_name_txt = clean_text(company_info.get('name', '')); c_addr_txt = clean_text(company_info.get('address', ''))
-    pdf.set_xy(120, 15); pdf.set_font("Arial", "B", 12); pdf.cell(0, 5, c_name_txt, ln=1, align='R')
-    pdf.set_font("Arial", size=10); pdf.multi_cell(0, 5, c_addr_txt, align='R')
-    pdf.set_xy(120, 35); pdf.set_font("Arial", "B", 16); pdf.set_text_color(43, 88, 141)
-    pdf.cell(0, 10, f"INVOICE #{inv_data['number']}", ln=1, align='R')
-    pdf.set_font("Arial", "B", 10); pdf.set_text_color(0, 0, 0); date_str = str(inv_data['date']) 
-    pdf.cell(0, 5, f"DATE: {date_str}", ln=1, align='R')
-    if project_info.get('po_number'): pdf.cell(0, 5, f"PO #: {clean_text(project_info['po_number'])}", ln=1, align='R')
-    pdf.set_xy(10, 60); pdf.set_font("Arial", "B", 10); pdf.cell(0, 5, "BILL TO:", ln=1)
-    pdf.set_font("Arial", size=10); pdf.cell(0, 5, clean_text(project_info['client_name']), ln=1)
-    if project_info.get('billing_street'): pdf.cell(0, 5, clean_text(project_info['billing_street']), ln=1); pdf.cell(0, 5, f"{clean_text(project_info['billing_city'])}, {clean_text(project_info['billing_state'])} {clean_text(project_info['billing_zip'])}", ln=1)
-    right_x = 110; current_y = 60; pdf.set_xy(right_x, current_y); pdf.set_font("Arial", "B", 10); pdf.cell(0, 5, "PROJECT SITE:"); current_y += 5; pdf.set_xy(right_x, current_y)
-    pdf.set_font("Arial", size=10); pdf.cell(0, 5, clean_text(project_info['name']))
-    if project_info.get('site_street'): current_y += 5; pdf.set_xy(right_x, current_y); pdf.cell(0, 5, clean_text(project_info['site_street'])); current_y += 5; pdf.set_xy(right_x, current_y); pdf.cell(0, 5, f"{clean_text(project_info['site_city'])}, {clean_text(project_info['site_state'])} {clean_text(project_info['site_zip'])}")
-    pdf.set_xy(10, 95); pdf.set_font("Arial", "B", 10); pdf.cell(0, 5, "DESCRIPTION:", ln=1); pdf.set_font("Arial", size=10); pdf.multi_cell(0, 5, clean_text(inv_data['description']))
-    pdf.ln(10); pdf.cell(0, 5, f"Subtotal: ${inv_data['amount'] - inv_data['tax']:,.2f}", ln=1, align='R'); pdf.cell(0, 5, f"Tax: ${inv_data['tax']:,.2f}", ln=1, align='R'); pdf.set_font("Arial", "B", 12); pdf.cell(0, 10, f"TOTAL: ${inv_data['amount']:,.2f}", border="T", ln=1, align='R')
-    if terms: pdf.ln(15); pdf.set_font("Arial", "B", 10); pdf.cell(0, 5, "TERMS & CONDITIONS:", ln=1); pdf.set_font("Arial", size=8); pdf.multi_cell(0, 4, clean_text(terms))
-    return pdf.output(dest='S').encode('latin-1', 'replace')
-
-def generate_statement_pdf(ledger_df, logo_data, company_info, project_name, client_name):
-    pdf = BB_PDF(); pdf.add_page()
-    if logo_data:
-        try:
-            image = Image.open(io.BytesIO(logo_data))
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                image.save(tmp, format="PNG"); tmp_path = tmp.name
-            pdf.image(tmp_path, 10, 10, 35); os.unlink(tmp_path)
-        except: pass
-    pdf.set_xy(120, 15); pdf.set_font("Arial", "B", 16); pdf.set_text_color(43, 88, 141); pdf.cell(0, 10, "PROJECT STATEMENT", ln=1, align='R')
-    pdf.set_font("Arial", size=10); pdf.set_text_color(0, 0, 0); pdf.cell(0, 5, f"Date: {datetime.date.today()}", ln=1, align='R'); pdf.ln(10)
-    pdf.set_font("Arial", "B", 12); pdf.cell(0, 5, f"Project: {clean_text(project_name)}", ln=1); pdf.set_font("Arial", size=10); pdf.cell(0, 5, f"Client: {clean_text(client_name)}", ln=1); pdf.ln(10)
-    pdf.set_fill_color(43, 88, 141); pdf.set_text_color(255, 255, 255); pdf.set_font("Arial", "B", 10)
-    pdf.cell(30, 8, "Date", 1, 0, 'C', 1); pdf.cell(80, 8, "Description", 1, 0, 'L', 1); pdf.cell(25, 8, "Charge", 1, 0, 'R', 1); pdf.cell(25, 8, "Payment", 1, 0, 'R', 1); pdf.cell(30, 8, "Balance", 1, 1, 'R', 1)
-    pdf.set_text_color(0, 0, 0); pdf.set_font("Arial", size=9); fill = False
-    for index, row in ledger_df.iterrows():
-        if fill: pdf.set_fill_color(240, 240, 240)
-        else: pdf.set_fill_color(255, 255, 255)
-        pdf.cell(30, 8, str(row['Date']), 1, 0, 'C', fill); pdf.cell(80, 8, clean_text(str(row['Details'])[:40]), 1, 0, 'L', fill); pdf.cell(25, 8, f"${row['Charge']:,.2f}", 1, 0, 'R', fill); pdf.cell(25, 8, f"${row['Payment']:,.2f}", 1, 0, 'R', fill); pdf.cell(30, 8, f"${row['Balance']:,.2f}", 1, 1, 'R', fill); fill = not fill
-    return pdf.output(dest='S').encode('latin-1', 'replace')
-
-def generate_dashboard_pdf(metrics, company_name, logo_data, chart_data):
-    pdf = BB_PDF()
-    pdf.add_page()
-    
-    # Logo
-    if logo_data:
-        try:
-            image = Image.open(io.BytesIO(logo_data))
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                image.save(tmp, format="PNG")
-                tmp_path = tmp.name
-            pdf.image(tmp_path, 10, 10, 35)
-            os.unlink(tmp_path)
-        except:
-            pass
-
-    # Header
-    pdf.set_xy(50, 15)
-    pdf.set_font("Arial", "B", 16)
-    pdf.set_text_color(43, 88, 141) # Brand Blue
-    pdf.cell(0, 10, f"EXECUTIVE DASHBOARD REPORT", ln=1, align='R')
-    
-    pdf.set_font("Arial", size=10)
-    pdf.set_text_color(0, 0, 0)
-    pdf.cell(0, 5, f"Company: {clean_text(company_name)}", ln=1, align='R')
-    pdf.cell(0, 5, f"Date: {datetime.date.today()}", ln=1, align='R')
-    pdf.ln(15)
-
-    # Metrics Section
-    pdf.set_font("Arial", "B", 14)
-    pdf.set_text_color(43, 88, 141)
-    pdf.cell(0, 10, "FINANCIAL SNAPSHOT", ln=1)
-    pdf.ln(2)
-    
-    pdf.set_font("Arial", size=12)
-    pdf.set_text_color(0, 0, 0)
-    
-    # Draw a simple table or list for metrics
-    for key, value in metrics.items():
-        pdf.set_font("Arial", "B", 11)
-        pdf.cell(60, 8, clean_text(key), 1)
-        pdf.set_font("Arial", size=11)
-        pdf.cell(40, 8, clean_text(str(value)), 1, 1, 'R')
-        
-    pdf.ln(10)
-    
-    # Chart Data Summary (Breakdown)
-    pdf.set_font("Arial", "B", 14)
-    pdf.set_text_color(43, 88, 141)
-    pdf.cell(0, 10, "BREAKDOWN", ln=1)
-    pdf.ln(2)
-    
-    pdf.set_font("Arial", size=11)
-    pdf.set_text_color(0, 0, 0)
-    
-    # Table Header
-    pdf.cell(60, 8, "Category", 1, 0, 'C', fill=False)
-    pdf.cell(40, 8, "Amount ($)", 1, 1, 'R', fill=False)
-    
-    for cat, amt in chart_data.items():
-        pdf.cell(60, 8, clean_text(cat), 1)
-        pdf.cell(40, 8, f"{amt:,.2f}", 1, 1, 'R')
-
-    return pdf.output(dest='S').encode('latin-1', 'replace')
-
 def create_checkout_session(customer_id, discount_percent, referral_id=None):
     try:
+        stripe = get_stripe()
         prices = stripe.Price.list(lookup_keys=[STRIPE_PRICE_LOOKUP_KEY], limit=1)
         if not prices.data: return None, "Price Not Found in Stripe"
         
@@ -443,31 +608,88 @@ def create_checkout_session(customer_id, discount_percent, referral_id=None):
     except Exception as e: return None, str(e)
 
 def create_stripe_customer(email, name):
-    try: return stripe.Customer.create(email=email, name=name).id
+    try: return get_stripe().Customer.create(email=email, name=name).id
     except: return None
 
+# --- SESSION TOKENS ---
+# "Remember Me" cookies carry a signed, expiring token instead of a bare username, so they cannot be forged.
+# Each token also signs the user's users.session_version, which logout and password changes bump, so a
+# stolen token can be revoked before it expires. Bump SESSION_TOKEN_VERSION to revoke every token at once.
+SESSION_COOKIE = "progressbill_session"
+SESSION_TOKEN_VERSION = 1
+SESSION_TTL_DAYS = 30
+
+@st.cache_resource
+def get_session_secret():
+    secret = os.environ.get("SESSION_SECRET")
+    if not secret:
+        try: secret = st.secrets.get("SESSION_SECRET")
+        except: pass
+    if not secret:
+        # Stable per deployment even without a dedicated secret; SESSION_SECRET should be set in production.
+        secret = hashlib.sha256(f"progressbill-session:{get_db_url() or STRIPE_SECRET_KEY}".encode()).hexdigest()
+    return secret.encode()
+
+def sign_session(user_id, expires, user_version):
+    msg = f"{user_id}.{expires}.{user_version}.{SESSION_TOKEN_VERSION}".encode()
+    return hmac.new(get_session_secret(), msg, hashlib.sha256).hexdigest()
+
+def make_session_token(user_id, user_version):
+    expires = int(time.time()) + SESSION_TTL_DAYS * 86400
+    return f"{user_id}.{expires}.{user_version}.{sign_session(user_id, expires, user_version)}"
+
+def verify_session_token(token):
+    # Returns (user_id, session_version) for a well-formed, unexpired, correctly signed token, else None.
+    # The caller still has to check session_version against the users row.
+    try:
+        uid, expires, user_version, sig = str(token).split(".")
+        uid, expires, user_version = int(uid), int(expires), int(user_version)
+    except ValueError: return None
+    if expires < time.time(): return None
+    # Compare bytes: a tampered cookie may carry non-ASCII text, which compare_digest rejects for str.
+    if not hmac.compare_digest(sig.encode(), sign_session(uid, expires, user_version).encode()): return None
+    return uid, user_version
+
+def get_session_version(user_id):
+    # Uncached on purpose: a revoked token must stop working everywhere immediately. None if the user is gone.
+    df = run_query("SELECT coalesce(session_version, 0) AS session_version FROM users WHERE id=:id", {"id": user_id}, strict=True)
+    return None if df.empty else int(df.iloc[0]['session_version'])
+
+def revoke_sessions(user_id):
+    execute_statement("UPDATE users SET session_version = coalesce(session_version, 0) + 1 WHERE id=:id", {"id": user_id})
+
+def sign_out():
+    # Logging out also revokes this user's remembered logins on every device.
+    if st.session_state.get("user_id"): revoke_sessions(st.session_state.user_id)
+    if COOKIE_MANAGER_AVAILABLE:
+        try: cookie_manager.delete(SESSION_COOKIE)
+        except Exception: pass
+    st.session_state.clear()
+    st.session_state['manual_logout'] = True
+    st.rerun()
+
 # --- 6. APP LOGIC & NAVIGATION ---
 if 'user_id' not in st.session_state: st.session_state.user_id = None
 if 'username' not in st.session_state: st.session_state.username = ""
 if 'page' not in st.session_state: st.session_state.page = "Dashboard"
 
 # --- AUTO-LOGIN VIA COOKIES ---
+# The cookie component reports its value (and triggers a rerun) as soon as the browser answers, so no
+# sleep or extra st.rerun() is needed; the remaining session fields load with the user context below.
 if st.session_state.user_id is None and COOKIE_MANAGER_AVAILABLE and not st.session_state.get("manual_logout", False):
-    time.sleep(0.1)
-    cookies = cookie_manager.get_all()
-    user_cookie = cookies.get("progressbill_user")
-    
-    if user_cookie:
-        df_cookie = run_query("SELECT id, username, subscription_status, stripe_customer_id, created_at, referral_code FROM users WHERE username=:u", params={"u": user_cookie})
-        if not df_cookie.empty:
-            rec = df_cookie.iloc[0]
-            st.session_state.user_id = int(rec['id'])
-            st.session_state.username = rec['username']
-            st.session_state.sub_status = rec['subscription_status']
-            st.session_state.stripe_cid = rec['stripe_customer_id']
-            st.session_state.created_at = rec['created_at']
-            st.session_state.my_ref_code = rec['referral_code']
-            st.rerun()
+    restored = verify_session_token(cookie_manager.get(SESSION_COOKIE) or "")
+    if restored:
+        token_uid, token_version = restored
+        try: current_version = get_session_version(token_uid)
+        except QueryFailed:
+            st.error("We can't reach the database right now. Please refresh in a moment."); st.stop()
+        if current_version == token_version:
+            st.session_state.user_id = token_uid
+            st.session_state.username = ""
+        else:
+            # Revoked (logout / password change elsewhere) or the account is gone: forget the token.
+            try: cookie_manager.delete(SESSION_COOKIE)
+            except Exception: pass
 
 # --- LOGIN / SIGNUP SCREENS ---
 if st.session_state.user_id is None:
@@ -494,11 +716,13 @@ if st.session_state.user_id is None:
                 submitted = st.form_submit_button("Login")
 
                 if submitted:
-                    df = run_query("SELECT id, password, email, subscription_status, stripe_customer_id, created_at, referral_code FROM users WHERE username=:u", params={"u": u})
+                    df = run_query("SELECT id, password, email, subscription_status, stripe_customer_id, created_at, referral_code, coalesce(session_version, 0) AS session_version FROM users WHERE username=:u", params={"u": u})
                     
+                    try: password_ok = not df.empty and check_password(p, df.iloc[0]['password'])
+                    except ServerBusy as busy: st.warning(str(busy)); st.stop()
                     if not df.empty:
                         rec = df.iloc[0]
-                        if check_password(p, rec['password']):
+                        if password_ok:
                             st.session_state.user_id = int(rec['id'])
                             st.session_state.username = u
                             st.session_state.email = rec['email']
@@ -508,7 +732,7 @@ if st.session_state.user_id is None:
                             st.session_state.my_ref_code = rec['referral_code']
                             
                             if remember and COOKIE_MANAGER_AVAILABLE:
-                                cookie_manager.set("progressbill_user", u, expires_at=datetime.datetime.now() + datetime.timedelta(days=30))
+                                cookie_manager.set(SESSION_COOKIE, make_session_token(int(rec['id']), int(rec['session_version'])), expires_at=datetime.datetime.now() + datetime.timedelta(days=SESSION_TTL_DAYS))
                             
                             st.success("Login successful!")
                             st.rerun()
@@ -518,6 +742,7 @@ if st.session_state.user_id is None:
                         st.error("Username not found")
 
         else: # OTP / Magic Code Login
+            supabase = init_supabase()
             if not supabase:
                 st.error("Email service not configured. Please contact support.")
             else:
@@ -592,7 +817,12 @@ if st.session_state.user_id is None:
                         if not check.empty:
                             st.error("Username already taken.")
                         else:
+                            # Hash first: if the auth pool is busy, nothing has been registered anywhere yet.
+                            try: h_p = hash_password(p)
+                            except ServerBusy as busy: st.warning(str(busy)); st.stop()
+
                             # 1. Register in Supabase Auth
+                            supabase = init_supabase()
                             if supabase:
                                 try:
                                     supabase.auth.sign_up({"email": e, "password": p})
@@ -600,7 +830,6 @@ if st.session_state.user_id is None:
                                     print(f"Auth warning: {auth_err}")
 
                             # 2. Register in SQL Database
-                            h_p = hash_password(p)
                             cid = create_stripe_customer(e, u)
                             my_ref_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
                             today_str = str(datetime.date.today())
@@ -621,21 +850,41 @@ if st.session_state.user_id is None:
 else:
     # --- LOGGED IN USER CONTEXT ---
     user_id = st.session_state.user_id
-    curr_username = st.session_state.username
     
     # Reload Context
-    df_user = run_query("SELECT subscription_status, created_at, referral_code, referred_by, company_name, company_address, logo_data, terms_conditions FROM users WHERE id=:id", params={"id": user_id})
+    try: df_user = get_user_context(user_id, tenant_version(user_id))
+    except QueryFailed:
+        # Database trouble is not a logout: keep the session and token, and let the user retry.
+        st.error("We can't reach the database right now. Please refresh in a moment."); st.stop()
     if df_user.empty:
+        # The account behind a (validly signed) token no longer exists: drop the token too, or auto-login would loop.
+        if COOKIE_MANAGER_AVAILABLE:
+            try: cookie_manager.delete(SESSION_COOKIE)
+            except Exception: pass
         st.session_state.clear()
+        st.session_state['manual_logout'] = True
         st.rerun()
     
     row = df_user.iloc[0]
+    if not st.session_state.username:
+        # Restored from a session token: fill in the rest of the session from this same query.
+        st.session_state.username = row['username']
+        st.session_state.email = row['email']
+        st.session_state.sub_status = row['subscription_status']
+        st.session_state.stripe_cid = row['stripe_customer_id']
+        st.session_state.created_at = row['created_at']
+        st.session_state.my_ref_code = row['referral_code']
+    curr_username = st.session_state.username
     status, created_at_str, my_code, referred_by = row['subscription_status'], row['created_at'], row['referral_code'], row['referred_by']
+    # Subscription status flips outside this process (Stripe checkout, admin tools), so it is read fresh, not from the cached context.
+    live_status = run_query("SELECT subscription_status FROM users WHERE id=:id", {"id": user_id})
+    if not live_status.empty: status = live_status.iloc[0, 0]
     
     c_name, c_addr, logo, terms = row['company_name'], row['company_address'], row['logo_data'], row['terms_conditions']
     
     # --- PRICING & SUBSCRIPTION LOGIC ---
-    active_referrals, discount_percent_earned = get_referral_stats(my_code)
+    try: active_referrals, discount_percent_earned = get_referral_stats(my_code)
+    except QueryFailed: active_referrals, discount_percent_earned = 0, 0
     discount_from_affiliate = 10 if referred_by else 0
     total_discount = min(discount_percent_earned + discount_from_affiliate, 100)
     
@@ -656,12 +905,7 @@ else:
     # --- AFFILIATE VIEW ---
     if status == 'Affiliate':
         st.warning("⚠️ This is an Affiliate Account. Access restricted to API tracking only.")
-        if st.button("Logout"): 
-            if COOKIE_MANAGER_AVAILABLE: 
-                cookie_manager.delete("progressbill_user")
-            st.session_state.clear()
-            st.session_state['manual_logout'] = True
-            st.rerun()
+        if st.button("Logout"): sign_out()
         st.stop()
 
     # --- SUBSCRIPTION ENFORCEMENT (FIXED) ---
@@ -726,19 +970,14 @@ else:
                 st.error("Account error: Missing Customer ID. Please contact support.")
             
         st.markdown("---")
-        if st.button("Logout"):
-            if COOKIE_MANAGER_AVAILABLE:
-                cookie_manager.delete("progressbill_user")
-            st.session_state.clear()
-            st.session_state['manual_logout'] = True
-            st.rerun()
+        if st.button("Logout"): sign_out()
         st.stop()
     
     # --- SIDEBAR MENU ---
     with st.sidebar:
         if logo: 
              try:
-                st.image(Image.open(io.BytesIO(logo)), width=120)
+                st.image(bytes(logo), width=120)
              except: st.header(c_name or "Menu")
         else: st.header("Menu")
         col1, col2 = st.columns(2)
@@ -749,23 +988,14 @@ else:
                 if st.button("📊\nDash", use_container_width=True): st.session_state.page = "Dashboard"
                 if st.button("📝\nInvoice", use_container_width=True): st.session_state.page = "Invoices"
                 if st.button("⚙️\nSettings", use_container_width=True): st.session_state.page = "Settings"
+                if st.button("🔎\nSearch", use_container_width=True): st.session_state.page = "Search"
         with col2:
             if curr_username == ADMIN_USERNAME:
-                 if st.button("🚪\nLogout", use_container_width=True):
-                    if COOKIE_MANAGER_AVAILABLE:
-                        cookie_manager.delete("progressbill_user")
-                    st.session_state.clear()
-                    st.session_state['manual_logout'] = True
-                    st.rerun()
+                 if st.button("🚪\nLogout", use_container_width=True): sign_out()
             else:
                 if st.button("📁\nProjs", use_container_width=True): st.session_state.page = "Projects"
                 if st.button("💰\nPay", use_container_width=True): st.session_state.page = "Payments"
-                if st.button("🚪\nLogout", use_container_width=True):
-                    if COOKIE_MANAGER_AVAILABLE:
-                        cookie_manager.delete("progressbill_user")
-                    st.session_state.clear()
-                    st.session_state['manual_logout'] = True
-                    st.rerun()
+                if st.button("🚪\nLogout", use_container_width=True): sign_out()
         
         st.divider()
         with st.expander("📱 Install App on Mobile"):
@@ -785,10 +1015,12 @@ else:
         with st.expander("🔒 Change Password"):
             new_pass = st.text_input("New Password", type="password")
             if st.button("Update Password"):
+                supabase = init_supabase()
                 if supabase:
                     try:
                         supabase.auth.update_user({"password": new_pass})
-                        st.success("Password updated!")
+                        revoke_sessions(user_id)
+                        st.success("Password updated! Remembered logins on other devices have been signed out.")
                     except Exception as e:
                         st.error(f"Error: {str(e)}")
                 else:
@@ -801,21 +1033,35 @@ else:
     # --- ADMIN DASHBOARD ---
     if curr_username == ADMIN_USERNAME and page == "Admin Dashboard":
         st.title("📊 Admin & Affiliate Intelligence")
-        tab_refs, tab_activity, tab_alerts, tab_manage = st.tabs(["📈 Referral Stats", "🔥 User Activity", "⚠️ Alerts", "⚙️ Manage Codes"])
+        tab_refs, tab_activity, tab_alerts, tab_manage, tab_server = st.tabs(["📈 Referral Stats", "🔥 User Activity", "⚠️ Alerts", "⚙️ Manage Codes", "🖥️ Server"])
         
         with tab_refs:
             st.subheader("Referral Performance Overview")
+            def get_referral_periods():
+                # Closed days come from the nightly referral_daily rollup (ar_jobs.py rollup); only signups after its watermark are scanned live.
+                wm = run_query("SELECT through_day FROM rollup_watermarks WHERE job = 'referral_daily'", replica=True)
+                through = wm.iloc[0, 0] if not wm.empty and wm.iloc[0, 0] is not None else None
+                after = ar_jobs.day_bound(through) if through else ""
+                today = datetime.date.today()
+                return through, run_query(f"""
+                    WITH counts AS (
+                        SELECT referral_code AS code, day, signups FROM referral_daily
+                        UNION ALL
+                        SELECT referred_by, {ar_jobs.SIGNUP_DAY}, COUNT(*) FROM users
+                        WHERE referred_by IS NOT NULL AND referred_by <> '' AND coalesce(created_at, '') > :after GROUP BY 1, 2
+                    )
+                    SELECT code, SUM(signups) FILTER (WHERE day >= :d30) AS d30, SUM(signups) FILTER (WHERE day >= :d60) AS d60, SUM(signups) AS life
+                    FROM counts GROUP BY code""", {"after": after, "d30": today - datetime.timedelta(days=30), "d60": today - datetime.timedelta(days=60)}, replica=True)
+
+            through, periods = get_referral_periods()
+            periods = periods.set_index("code").fillna(0).astype(int) if not periods.empty else pd.DataFrame(columns=["d30", "d60", "life"])
             def calculate_periods(code):
-                now = datetime.datetime.now()
-                refs = run_query("SELECT created_at FROM users WHERE referred_by=:c", {"c": code})
-                if refs.empty: return 0, 0, 0
-                refs['created_at'] = pd.to_datetime(refs['created_at'], errors='coerce')
-                d30 = refs[refs['created_at'] >= (now - datetime.timedelta(days=30))].shape[0]
-                d60 = refs[refs['created_at'] >= (now - datetime.timedelta(days=60))].shape[0]
-                return d30, d60, refs.shape[0]
+                if code not in periods.index: return 0, 0, 0
+                r = periods.loc[code]
+                return r["d30"], r["d60"], r["life"]
 
             st.markdown("#### 🏢 Affiliate Partners")
-            affiliates = run_query("SELECT username, referral_code FROM users WHERE subscription_status='Affiliate'")
+            affiliates = run_query("SELECT username, referral_code FROM users WHERE subscription_status='Affiliate'", replica=True)
             if not affiliates.empty:
                 aff_data = []
                 for _, row in affiliates.iterrows():
@@ -826,42 +1072,31 @@ else:
 
             st.markdown("---")
             st.markdown("#### 👤 Standard Users (Referral Program)")
-            referrers = run_query("SELECT DISTINCT referred_by FROM users WHERE referred_by IS NOT NULL AND referred_by != ''")
-            if not referrers.empty:
+            if not periods.empty:
                 user_ref_data = []
                 aff_codes = affiliates['referral_code'].tolist() if not affiliates.empty else []
-                for code in referrers['referred_by'].unique():
-                    if code in aff_codes: continue
-                    owner = run_query("SELECT username FROM users WHERE referral_code=:c", {"c": code})
-                    owner_name = owner.iloc[0,0] if not owner.empty else "Unknown"
+                codes = [code for code in periods.index if code not in aff_codes]
+                owners = run_query("SELECT referral_code, username FROM users WHERE referral_code = ANY(:codes)", {"codes": codes}, replica=True) if codes else pd.DataFrame()
+                owner_names = dict(zip(owners['referral_code'], owners['username'])) if not owners.empty else {}
+                for code in codes:
                     d30, d60, life = calculate_periods(code)
-                    user_ref_data.append({"User": owner_name, "Code": code, "30 Days": d30, "Lifetime": life})
+                    user_ref_data.append({"User": owner_names.get(code, "Unknown"), "Code": code, "30 Days": d30, "Lifetime": life})
                 if user_ref_data: st.dataframe(pd.DataFrame(user_ref_data), use_container_width=True)
                 else: st.info("No user-to-user referrals yet.")
             else: st.info("No referrals found.")
+            if through is None: st.caption("Referral rollup has not run yet; counts are computed live. Schedule `python ar_jobs.py rollup` nightly.")
 
         with tab_activity:
             st.subheader("🔥 Most Active Users (Engagement)")
             def get_activity_counts(days):
                 cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
-                sql_proj = "SELECT user_id, COUNT(*) as cnt FROM projects WHERE start_date >= :d GROUP BY user_id"
-                sql_inv = "SELECT user_id, COUNT(*) as cnt FROM invoices WHERE issue_date >= :d GROUP BY user_id"
-                sql_pay = "SELECT user_id, COUNT(*) as cnt FROM payments WHERE payment_date >= :d GROUP BY user_id"
-                df_p = run_query(sql_proj, {"d": cutoff}); df_i = run_query(sql_inv, {"d": cutoff}); df_pay = run_query(sql_pay, {"d": cutoff})
-                activity = {}
-                for df, label in [(df_p, 'Projects'), (df_i, 'Invoices'), (df_pay, 'Payments')]:
-                    if not df.empty:
-                        for _, r in df.iterrows():
-                            uid = r['user_id']
-                            if uid not in activity: activity[uid] = {'Projects':0, 'Invoices':0, 'Payments':0}
-                            activity[uid][label] = r['cnt']
-                final_rows = []
-                for uid, counts in activity.items():
-                    u_res = run_query("SELECT username FROM users WHERE id=:id", {"id": uid})
-                    if not u_res.empty:
-                        u_name = u_res.iloc[0,0]
-                        final_rows.append({"User": u_name, **counts, "Total Actions": sum(counts.values())})
-                return pd.DataFrame(final_rows).sort_values("Total Actions", ascending=False) if final_rows else pd.DataFrame()
+                # Daily activity projection (maintained by ar_events), one grouped read with usernames joined in.
+                df = run_query("""SELECT u.username AS "User", SUM(a.projects) AS "Projects", SUM(a.invoices) AS "Invoices", SUM(a.payments) AS "Payments"
+                                  FROM proj_user_activity_daily a JOIN users u ON u.id = a.user_id
+                                  WHERE a.day >= :d GROUP BY u.username""", {"d": cutoff}, replica=True)
+                if df.empty: return pd.DataFrame()
+                df["Total Actions"] = df[["Projects", "Invoices", "Payments"]].sum(axis=1)
+                return df.sort_values("Total Actions", ascending=False)
 
             c1, c2 = st.columns(2)
             with c1:
@@ -877,7 +1112,8 @@ else:
 
         with tab_alerts:
             st.subheader("⚠️ At-Risk / Incomplete Setup")
-            risk_users = run_query("SELECT u.username, u.company_name, u.email, COUNT(i.id) as inv_count FROM users u JOIN invoices i ON u.id = i.user_id WHERE (u.company_name IS NULL OR u.company_name = '' OR u.logo_data IS NULL) GROUP BY u.id")
+            # Invoice counts come from the tenant totals projection rather than a scan of every invoice.
+            risk_users = run_query("SELECT u.username, u.company_name, u.email, t.invoice_count as inv_count FROM users u JOIN proj_tenant_totals t ON t.user_id = u.id WHERE t.invoice_count > 0 AND (u.company_name IS NULL OR u.company_name = '' OR u.logo_data IS NULL)", replica=True)
             if not risk_users.empty:
                 for _, row in risk_users.iterrows():
                     st.warning(f"**{row['username']}** ({row['email']})")
@@ -893,69 +1129,161 @@ else:
                 if submitted_aff:
                     aff_name_clean = aff_name.lower().strip()
                     fake_email = f"{aff_name_clean.replace(' ', '')}@affiliate.com"
-                    fake_pass = hash_password("affiliate_dummy_pass")
+                    try: fake_pass = hash_password("affiliate_dummy_pass")
+                    except ServerBusy as busy: st.warning(str(busy)); st.stop()
                     try:
                         execute_statement("INSERT INTO users (username, password, email, referral_code, subscription_status) VALUES (:u, :p, :e, :rc, 'Affiliate')", params={"u": aff_name_clean, "p": fake_pass, "e": fake_email, "rc": aff_code})
                         st.success(f"Affiliate Created: Code **{aff_code}** is live!")
                     except Exception as e: st.error(f"Error (Code likely taken): {e}")
 
+        with tab_server:
+            st.subheader("Worker Pools")
+            st.caption("Shared across all sessions on this server process. Rejected = requests turned away with a 'server busy' message.")
+            st.dataframe(pd.DataFrame([pool.snapshot() for pool in get_worker_pools().values()]), use_container_width=True)
+            st.subheader("Session Memory")
+            st.caption("Generated files live in the shared artifact store; sessions only hold handles. State sizes are approximate, include media Streamlit keeps in memory for the session, and are refreshed on each session's last rerun.")
+            st.dataframe(pd.DataFrame([get_artifact_store().snapshot()]), use_container_width=True)
+            with get_session_registry()["lock"]: sessions = [dict(r) for r in get_session_registry()["sessions"].values()]
+            if sessions:
+                df_sessions = pd.DataFrame(sessions).sort_values("State KB", ascending=False)
+                df_sessions["Last Seen"] = pd.to_datetime(df_sessions["Last Seen"], unit="s").dt.strftime("%H:%M:%S")
+                st.caption(f"{len(sessions)} sessions | total {df_sessions['State KB'].sum():,.0f} KB | max {df_sessions['State KB'].max():,.1f} KB")
+                st.dataframe(df_sessions, use_container_width=True)
+            st.subheader("Read Replica")
+            if replica_engine:
+                lag, replay_lsn = replica_status()
+                if lag is None: st.warning("Replica unreachable: all reads are going to the primary.")
+                else: st.caption(f"Lag {lag:.1f}s (tolerance {REPLICA_MAX_LAG_SECONDS:.0f}s) | {'serving report reads' if lag <= REPLICA_MAX_LAG_SECONDS else 'too far behind, reads on primary'} | {len(get_replica_state()['writes'])} tenants with tracked writes")
+            else: st.caption("No replica configured (SUPABASE_REPLICA_URL); all reads use the primary.")
+            st.subheader("Statement Delivery")
+            st.caption("Failed sends from `python ar_jobs.py statements` after all retries.")
+            dead = run_query("SELECT d.failed_at, u.username, d.client_name, d.email, d.period, d.attempts, d.error FROM statement_dead_letters d LEFT JOIN users u ON u.id = d.user_id ORDER BY d.id DESC LIMIT 50", replica=True)
+            if not dead.empty: st.dataframe(dead, use_container_width=True)
+            else: st.info("No failed statement deliveries.")
+            st.subheader("Ledger Projections")
+            st.caption("Dashboard totals and activity counts are projected from the ledger_events log. Each tenant's dashboard logs new rows written outside this app (e.g. BalanceBuild Pro) when its totals are recomputed; edits and deletes of existing rows are picked up by the scheduled `python ar_jobs.py projections` job, which also backfills the log on a new deploy.")
+
     elif page == "Dashboard":
+        import altair as alt
+        import ar_pdf
         st.title("Financial Overview")
         st.caption(f"Welcome back, {c_name or 'Admin'}")
-        def get_scalar(q, p):
-            res = run_query(q, p)
-            return res.iloc[0, 0] if not res.empty and res.iloc[0, 0] is not None else 0.0
-        t_contracts = get_scalar("SELECT SUM(quoted_price) FROM projects WHERE user_id=:id", {"id": user_id})
-        t_invoiced = get_scalar("SELECT SUM(amount) FROM invoices WHERE user_id=:id", {"id": user_id})
-        t_collected = get_scalar("SELECT SUM(amount) FROM payments WHERE user_id=:id", {"id": user_id})
+        show_archived = st.checkbox("Include Archived Projects", key="dash_archived")
+        arch = {"id": user_id, "arch": 1 if show_archived else 0}
+        try: t_contracts, t_invoiced, t_collected = get_dashboard_totals(user_id, show_archived, tenant_version(user_id))
+        except QueryFailed: st.error("Couldn't load your totals right now. Please refresh in a moment."); st.stop()
         remaining_to_invoice = t_contracts - t_invoiced; outstanding_ar = t_invoiced - t_collected
         c1, c2 = st.columns(2)
-        with c1: metric_card("Total Contracts", f"${t_contracts:,.2f}", "Total Booked Work"); metric_card("Total Collected", f"${t_collected:,.2f}", "Cash in Bank")
-        with c2: metric_card("Total Invoiced", f"${t_invoiced:,.2f}", f"Remaining: ${remaining_to_invoice:,.2f}"); metric_card("Outstanding AR", f"${outstanding_ar:,.2f}", "Unpaid Invoices")
+        with c1: metric_card("Total Contracts", format_cents(t_contracts), "Total Booked Work"); metric_card("Total Collected", format_cents(t_collected), "Cash in Bank")
+        with c2: metric_card("Total Invoiced", format_cents(t_invoiced), f"Remaining: {format_cents(remaining_to_invoice)}"); metric_card("Outstanding AR", format_cents(outstanding_ar), "Unpaid Invoices")
         chart_data_pdf = {'Invoiced': t_invoiced, 'Collected': t_collected, 'Outstanding': outstanding_ar, 'Remaining': remaining_to_invoice}
-        dash_metrics = {"Total Contracts": f"${t_contracts:,.2f}", "Total Invoiced": f"${t_invoiced:,.2f}", "Total Collected": f"${t_collected:,.2f}", "Remaining to Invoice": f"${remaining_to_invoice:,.2f}", "Outstanding AR": f"${outstanding_ar:,.2f}"}
-        pdf_bytes = generate_dashboard_pdf(dash_metrics, c_name or "My Firm", logo, chart_data_pdf)
-        st.download_button("📂 Download Dashboard Report (PDF)", pdf_bytes, f"Executive_Report_{datetime.date.today()}.pdf", "application/pdf")
+        dash_metrics = {"Total Contracts": format_cents(t_contracts), "Total Invoiced": format_cents(t_invoiced), "Total Collected": format_cents(t_collected), "Remaining to Invoice": format_cents(remaining_to_invoice), "Outstanding AR": format_cents(outstanding_ar)}
+        try:
+            pdf_bytes = get_dashboard_pdf(user_id, show_archived, tenant_version(user_id), dash_metrics, c_name or "My Firm", logo, chart_data_pdf)
+            st.download_button("📂 Download Dashboard Report (PDF)", pdf_bytes, f"Executive_Report_{datetime.date.today()}.pdf", "application/pdf")
+        except ServerBusy as busy: st.warning(f"Dashboard report unavailable: {busy}")
         st.markdown("### Analysis")
         vc1, vc2 = st.columns(2)
         with vc1:
             st.markdown("##### Revenue Breakdown")
-            chart_data = pd.DataFrame({'Category': ['Invoiced', 'Collected', 'Outstanding AR'], 'Amount': [t_invoiced, t_collected, outstanding_ar]})
+            chart_data = pd.DataFrame({'Category': ['Invoiced', 'Collected', 'Outstanding AR'], 'Amount': [t_invoiced / 100, t_collected / 100, outstanding_ar / 100]})
             c = alt.Chart(chart_data).mark_bar().encode(x='Category', y='Amount', color=alt.Color('Category', scale=alt.Scale(scheme='tableau10'))).properties(height=250); st.altair_chart(c, theme="streamlit", use_container_width=True)
         with vc2:
             st.markdown("##### Contract Progress")
-            pie_data = pd.DataFrame({'Status': ['Invoiced', 'Remaining'], 'Value': [t_invoiced, remaining_to_invoice]})
+            pie_data = pd.DataFrame({'Status': ['Invoiced', 'Remaining'], 'Value': [t_invoiced / 100, remaining_to_invoice / 100]})
             base = alt.Chart(pie_data).encode(theta=alt.Theta("Value", stack=True)); pie = base.mark_arc(innerRadius=50).encode(color=alt.Color("Status", scale=alt.Scale(domain=['Invoiced', 'Remaining'], range=['#2B588D', '#DAA520'])), tooltip=["Status", "Value"]).properties(height=250); st.altair_chart(pie, theme="streamlit", use_container_width=True)
-        st.markdown("---"); st.subheader("🔍 Project Deep-Dive")
-        projs = run_query("SELECT id, name, client_name FROM projects WHERE user_id=:id", {"id": user_id})
-        if not projs.empty:
+
+        # Chart controls, deep-dive and statements are fragments: touching them reruns only that section.
+        @st.fragment
+        def billing_trend():
+            st.markdown("### Billing & Collections Trend")
+            tc1, tc2 = st.columns(2)
+            grain = tc1.radio("Bucket By", ["Month", "Quarter"], key="trend_grain")
+            split = tc2.radio("View", ["All Projects", "By Project Status"], key="trend_split")
+            try: trend = get_billing_trend(user_id, grain.lower(), tenant_version(user_id))
+            except QueryFailed: st.warning("Trend data is temporarily unavailable."); return
+            if not trend.empty:
+                if split == "All Projects":
+                    totals = trend.groupby('period', as_index=False)[['invoiced', 'collected', 'outstanding']].sum()
+                    long_df = totals.melt('period', var_name='Metric', value_name='Amount')
+                    long_df['Amount'] = long_df['Amount'] / 100
+                    long_df['Metric'] = long_df['Metric'].str.title()
+                    t_chart = alt.Chart(long_df).mark_line(point=True).encode(x=alt.X('period:T', title=grain), y=alt.Y('Amount:Q', title='Amount ($)'), color=alt.Color('Metric:N', scale=alt.Scale(domain=['Invoiced', 'Collected', 'Outstanding'], range=['#2B588D', '#28a745', '#DAA520'])), tooltip=[alt.Tooltip('period:T', title=grain), 'Metric', alt.Tooltip('Amount:Q', format='$,.2f')]).properties(height=300)
+                else:
+                    metric = st.selectbox("Metric", ["Invoiced", "Collected", "Outstanding"], key="trend_metric")
+                    trend = trend.assign(**{metric.lower(): trend[metric.lower()] / 100})
+                    t_chart = alt.Chart(trend).mark_bar().encode(x=alt.X('period:T', title=grain), y=alt.Y(f'{metric.lower()}:Q', title=f'{metric} ($)'), color=alt.Color('status:N', title='Project Status', scale=alt.Scale(scheme='tableau10')), tooltip=[alt.Tooltip('period:T', title=grain), 'status', alt.Tooltip(f'{metric.lower()}:Q', format='$,.2f')]).properties(height=300)
+                st.altair_chart(t_chart, theme="streamlit", use_container_width=True)
+            else: st.info("No invoices or payments to chart yet.")
+            perf_caption("Trend")
+        billing_trend()
+
+        @st.fragment
+        def cashflow_forecast():
+            st.markdown("### Cash-Flow Forecast")
+            months = st.slider("Forecast Horizon (Months)", 6, 12, 6, key="forecast_months")
+            try: forecast = get_cashflow_forecast(user_id, int(round(months * 52 / 12)), tenant_version(user_id))
+            except QueryFailed: st.warning("Forecast data is temporarily unavailable."); return
+            if forecast['billings'].sum() > 0:
+                fc1, fc2 = st.columns(2)
+                with fc1: metric_card("Expected Billings", f"${forecast['billings'].sum():,.2f}", f"Next {months} Months")
+                with fc2: metric_card("Expected Collections", f"${forecast['collections'].sum():,.2f}", "After Payment Lag, Retainage at Release")
+                long_fc = forecast.melt('week', var_name='Metric', value_name='Amount')
+                long_fc['Metric'] = long_fc['Metric'].str.title()
+                f_chart = alt.Chart(long_fc).mark_bar(opacity=0.8).encode(x=alt.X('week:T', title='Week'), xOffset='Metric:N', y=alt.Y('Amount:Q', title='Amount ($)'), color=alt.Color('Metric:N', scale=alt.Scale(domain=['Billings', 'Collections'], range=['#2B588D', '#28a745'])), tooltip=[alt.Tooltip('week:T', title='Week Of'), 'Metric', alt.Tooltip('Amount:Q', format='$,.2f')]).properties(height=300)
+                st.altair_chart(f_chart, theme="streamlit", use_container_width=True)
+                st.caption("Based on unbilled contract value of Pre-Construction and Course of Construction projects. Invoices already issued are not included.")
+            else: st.info("No unbilled work on active projects to forecast.")
+            perf_caption("Forecast")
+        cashflow_forecast()
+
+        @st.fragment
+        def project_deep_dive(projs):
             p_choice = st.selectbox("Select Project", projs['name'])
             p_id = int(projs[projs['name'] == p_choice]['id'].values[0])
             client_name = projs[projs['name'] == p_choice]['client_name'].values[0]
-            p_row = run_query("SELECT quoted_price, start_date, duration_days, status FROM projects WHERE id=:id", {"id": p_id}).iloc[0]
-            p_quoted = p_row['quoted_price'] or 0.0
-            df_inv = run_query("SELECT issue_date, invoice_num, amount, description FROM invoices WHERE project_id=:pid", {"pid": p_id})
-            df_pay = run_query("SELECT payment_date, amount, notes FROM payments WHERE project_id=:pid", {"pid": p_id})
-            ledger = []
-            for _, r in df_inv.iterrows(): ledger.append({'Date': r['issue_date'], 'Details': f"Invoice #{r['invoice_num']}", 'Charge': r['amount'], 'Payment': 0, 'Type': 'Inv'})
-            for _, r in df_pay.iterrows(): ledger.append({'Date': r['payment_date'], 'Details': f"Payment ({r['notes']})", 'Charge': 0, 'Payment': r['amount'], 'Type': 'Pay'})
-            df_ledger = pd.DataFrame(ledger)
+            p_row = run_query(f"SELECT {cents_sql('quoted_price')} AS quoted_price, start_date, duration_days, status FROM projects WHERE id=:id", {"id": p_id}, replica=True).iloc[0]
+            p_quoted = int(p_row['quoted_price'])
+            df_ledger = run_query(ledger_query("p.id = :pid"), {"uid": user_id, "pid": p_id, "start": None, "end": None}, replica=True)
             if not df_ledger.empty:
-                df_ledger['Date'] = pd.to_datetime(df_ledger['Date'])
-                df_ledger = df_ledger.sort_values(by='Date').reset_index(drop=True)
-                df_ledger['Balance'] = (df_ledger['Charge'] - df_ledger['Payment']).cumsum()
-                df_ledger['Date'] = df_ledger['Date'].dt.date
-                tot_bill = df_ledger['Charge'].sum(); tot_paid = df_ledger['Payment'].sum(); curr_bal = tot_bill - tot_paid
+                df_ledger = df_ledger.rename(columns={'tx_date': 'Date', 'details': 'Details', 'charge': 'Charge', 'payment': 'Payment', 'project_balance': 'Balance'})
+                tot_bill = int(df_ledger['Charge'].sum()); tot_paid = int(df_ledger['Payment'].sum()); curr_bal = tot_bill - tot_paid
                 pc1, pc2 = st.columns(2)
-                with pc1: metric_card("Project Value", f"${p_quoted:,.2f}")
-                with pc2: metric_card("Current Balance", f"${curr_bal:,.2f}", "Outstanding")
+                with pc1: metric_card("Project Value", format_cents(p_quoted))
+                with pc2: metric_card("Current Balance", format_cents(curr_bal), "Outstanding")
                 st.markdown("### Ledger History")
                 col_pdf, col_tbl = st.columns([1,3])
                 with col_pdf:
-                    pdf_bytes = generate_statement_pdf(df_ledger, logo, {"name": c_name, "address": c_addr}, p_choice, client_name)
-                    st.download_button("📄 Download Statement", pdf_bytes, f"statement_{p_choice}.pdf", "application/pdf")
-                st.dataframe(df_ledger[['Date', 'Details', 'Charge', 'Payment', 'Balance']].style.format("{:.2f}", subset=['Charge', 'Payment', 'Balance']), use_container_width=True)
+                    # Rendered on click only (deferred data), not on every run of the fragment.
+                    stmt_args = (df_ledger, logo, {"name": c_name, "address": c_addr}, p_choice, client_name)
+                    st.download_button("📄 Download Statement", lambda: render_pdf(ar_pdf.generate_statement_pdf, *stmt_args), f"statement_{p_choice}.pdf", "application/pdf")
+                st.dataframe(df_ledger[['Date', 'Details', 'Charge', 'Payment', 'Balance']].style.format(format_cents, subset=['Charge', 'Payment', 'Balance']), use_container_width=True)
             else: st.info("No transactions yet.")
+            perf_caption("Deep-Dive")
+
+        # Separate fragment: editing the statement client or dates reruns only this block, not the project ledger.
+        @st.fragment
+        def client_statement(projs):
+            st.subheader("🧾 Client Statement")
+            st.caption("All of a client's projects on one statement, with per-project subtotals and a combined running balance.")
+            cs1, cs2, cs3 = st.columns([2, 1, 1])
+            stmt_client = cs1.selectbox("Client", sorted(projs['client_name'].dropna().unique()), key="stmt_client")
+            stmt_start = cs2.date_input("From", value=datetime.date.today().replace(month=1, day=1), key="stmt_start")
+            stmt_end = cs3.date_input("To", value=datetime.date.today(), key="stmt_end")
+            if st.button("Build Client Statement"):
+                client_filter = "p.client_name = :client" + ("" if show_archived else " AND p.is_archived = 0")
+                try:
+                    stmt_pdf = render_pdf(ar_pdf.render_client_statement, get_db_url(), ledger_query(client_filter), {"uid": user_id, "client": stmt_client, "start": stmt_start, "end": stmt_end}, logo, {"name": c_name, "address": c_addr}, stmt_client, str(stmt_start), str(stmt_end), opening_balance_query(client_filter))
+                    keep_artifact("client_stmt_artifact", stmt_pdf, f"Statement_{stmt_client}_{stmt_start}_{stmt_end}.pdf", "application/pdf")
+                except ServerBusy as busy: st.warning(str(busy))
+            artifact_download("client_stmt_artifact", "📄 Download Client Statement")
+            perf_caption("Client Statement")
+
+        st.markdown("---"); st.subheader("🔍 Project Deep-Dive")
+        projs = run_query("SELECT id, name, client_name FROM projects WHERE user_id=:id AND (is_archived = 0 OR :arch = 1)", arch)
+        if not projs.empty:
+            project_deep_dive(projs)
+            st.markdown("---"); client_statement(projs)
         else: st.info("No projects found.")
 
     elif page == "Projects":
@@ -964,6 +1292,7 @@ else:
             with st.form("new_proj"):
                 c1, c2 = st.columns(2)
                 n = c1.text_input("Project Name"); c = c2.text_input("Client Name")
+                c_email = c2.text_input("Client Email (monthly statements)")
                 q_str = c1.text_input("Quoted Price ($)", placeholder="0.00"); dur = c2.number_input("Duration (Days)", min_value=1)
                 st.markdown("##### Addresses"); ac1, ac2 = st.columns(2)
                 with ac1: b_street = st.text_input("Billing Street"); b_city = st.text_input("Billing City"); b_state = st.text_input("Billing State"); b_zip = st.text_input("Billing Zip")
@@ -972,30 +1301,53 @@ else:
                 status = c1.selectbox("Status", ["Bidding", "Pre-Construction", "Course of Construction", "Warranty", "Post-Construction"]); is_tax_exempt = c2.checkbox("Tax Exempt?"); scope = st.text_area("Scope")
                 submitted = st.form_submit_button("Create Project")
                 if submitted:
-                    q = parse_currency(q_str)
-                    execute_statement("INSERT INTO projects (user_id, name, client_name, quoted_price, start_date, duration_days, billing_street, billing_city, billing_state, billing_zip, site_street, site_city, site_state, site_zip, is_tax_exempt, po_number, status, scope_of_work) VALUES (:uid, :n, :c, :q, :sd, :d, :bs, :bc, :bst, :bz, :ss, :sc, :sst, :sz, :ite, :po, :stat, :scope)", params={"uid": user_id, "n": n, "c": c, "q": q, "sd": str(start_d), "d": dur, "bs": b_street, "bc": b_city, "bst": b_state, "bz": b_zip, "ss": s_street, "sc": s_city, "sst": s_state, "sz": s_zip, "ite": 1 if is_tax_exempt else 0, "po": po, "stat": status, "scope": scope})
+                    q = cents_to_decimal(to_cents(q_str))
+                    execute_statement("INSERT INTO projects (user_id, name, client_name, quoted_price, start_date, duration_days, billing_street, billing_city, billing_state, billing_zip, site_street, site_city, site_state, site_zip, is_tax_exempt, po_number, status, scope_of_work, client_email) VALUES (:uid, :n, :c, :q, :sd, :d, :bs, :bc, :bst, :bz, :ss, :sc, :sst, :sz, :ite, :po, :stat, :scope, :ce) RETURNING id", params={"uid": user_id, "n": n, "c": c, "q": q, "ce": c_email.strip() or None, "sd": str(start_d), "d": dur, "bs": b_street, "bc": b_city, "bst": b_state, "bz": b_zip, "ss": s_street, "sc": s_city, "sst": s_state, "sz": s_zip, "ite": 1 if is_tax_exempt else 0, "po": po, "stat": status, "scope": scope},
+                                      event={"user_id": user_id, "event_type": "project.created", "amount_cents": to_cents(q_str), "event_date": start_d, "payload": {"name": n, "status": status}})
                     st.success("Project Saved"); st.rerun()
         st.markdown("### Active Projects")
-        projs = run_query("SELECT id, name, client_name, status, quoted_price FROM projects WHERE user_id=:id", {"id": user_id})
+        projs = run_query("SELECT id, name, client_name, client_email, status, quoted_price FROM projects WHERE user_id=:id AND is_archived = 0", {"id": user_id})
         if not projs.empty:
-            c_man_1, c_man_2 = st.columns([2, 2])
+            c_man_1, c_man_2, c_man_3 = st.columns(3)
             with c_man_1:
                 p_update = st.selectbox("Update Project", projs['name'], key="up_sel")
                 new_stat = st.selectbox("New Status", ["Bidding", "Pre-Construction", "Course of Construction", "Warranty", "Post-Construction"], key="new_stat")
                 if st.button("Update Status"):
                     pid = int(projs[projs['name'] == p_update]['id'].values[0])
-                    execute_statement("UPDATE projects SET status=:s WHERE id=:id", {"s": new_stat, "id": pid}); st.success("Updated"); st.rerun()
+                    execute_statement("UPDATE projects SET status=:s WHERE id=:id AND user_id=:uid RETURNING id", {"s": new_stat, "id": pid, "uid": user_id}, event={"user_id": user_id, "event_type": "project.status_changed", "payload": {"status": new_stat}}); st.success("Updated"); st.rerun()
+                cur_email = projs[projs['name'] == p_update]['client_email'].values[0]
+                new_email = st.text_input("Client Email", value=cur_email or "", key=f"client_email_{p_update}")
+                if st.button("Save Email"):
+                    pid = int(projs[projs['name'] == p_update]['id'].values[0])
+                    execute_statement("UPDATE projects SET client_email=:e WHERE id=:id AND user_id=:uid", {"e": new_email.strip() or None, "id": pid, "uid": user_id}); st.success("Email saved"); st.rerun()
             with c_man_2:
+                p_arch = st.selectbox("Archive Project", projs['name'], key="arch_sel")
+                if st.button("Archive"):
+                    pid = int(projs[projs['name'] == p_arch]['id'].values[0])
+                    execute_statement("UPDATE projects SET is_archived=1 WHERE id=:id AND user_id=:uid RETURNING id", {"id": pid, "uid": user_id}, event={"user_id": user_id, "event_type": "project.archived"}); st.success("Archived"); st.rerun()
+                if st.button("Archive All Post-Construction"):
+                    execute_statement("UPDATE projects SET is_archived=1 WHERE user_id=:uid AND status='Post-Construction' AND is_archived = 0 RETURNING id", {"uid": user_id}, event={"user_id": user_id, "event_type": "project.archived"}); st.success("Closed projects archived"); st.rerun()
+            with c_man_3:
                 p_del = st.selectbox("Delete Project", projs['name'], key="del_sel")
                 if st.button("Delete", type="primary"):
                     pid = int(projs[projs['name'] == p_del]['id'].values[0])
-                    execute_statement("DELETE FROM projects WHERE id=:id", {"id": pid}); execute_statement("DELETE FROM invoices WHERE project_id=:id", {"id": pid}); execute_statement("DELETE FROM payments WHERE project_id=:id", {"id": pid}); st.warning("Deleted"); st.rerun()
+                    execute_statement(DELETE_PROJECT_QUERY, {"pid": pid, "uid": user_id}, event={"user_id": user_id, "event_type": "project.deleted"}); st.warning("Deleted"); st.rerun()
             st.dataframe(projs, use_container_width=True)
         else: st.info("No active projects.")
+        with st.expander("🗄️ Archived Projects"):
+            archived = run_query("SELECT id, name, client_name, status, quoted_price FROM projects WHERE user_id=:id AND is_archived = 1", {"id": user_id})
+            if not archived.empty:
+                st.dataframe(archived, use_container_width=True)
+                p_restore = st.selectbox("Restore Project", archived['name'], key="restore_sel")
+                if st.button("Restore"):
+                    pid = int(archived[archived['name'] == p_restore]['id'].values[0])
+                    execute_statement("UPDATE projects SET is_archived=0 WHERE id=:id AND user_id=:uid RETURNING id", {"id": pid, "uid": user_id}, event={"user_id": user_id, "event_type": "project.restored"}); st.success("Restored"); st.rerun()
+            else: st.info("No archived projects.")
 
     elif page == "Invoices":
+        import ar_pdf
         st.subheader("Create Invoice")
-        projs = run_query("SELECT * FROM projects WHERE user_id=:id", {"id": user_id})
+        projs = run_query("SELECT * FROM projects WHERE user_id=:id AND is_archived = 0", {"id": user_id})
         if not projs.empty:
             p = st.selectbox("Project", projs['name']); row = projs[projs['name']==p].iloc[0]
             tax_label = "Tax ($)" + (" - [EXEMPT]" if row['is_tax_exempt'] else "")
@@ -1015,24 +1367,23 @@ else:
                 verified = st.checkbox("I verify billing is correct"); submitted = st.form_submit_button("Generate Invoice")
                 if submitted:
                     if verified:
-                        a = parse_currency(a_str); t = parse_currency(t_str)
-                        res_num = run_query("SELECT MAX(invoice_num) FROM invoices WHERE user_id=:id", {"id": user_id})
+                        a = to_cents(a_str); t = to_cents(t_str)
+                        res_num = run_query(NEXT_INVOICE_NUMBER_QUERY, {"uid": user_id})
                         current_max = res_num.iloc[0, 0] if not res_num.empty and res_num.iloc[0, 0] is not None else 1000
                         num = current_max + 1
                         p_info = {k: row[k] for k in ['name', 'client_name', 'billing_street', 'billing_city', 'billing_state', 'billing_zip', 'site_street', 'site_city', 'site_state', 'site_zip', 'po_number']}
-                        pdf = generate_pdf_invoice({'number': num, 'amount': a+t, 'tax': t, 'date': str(inv_date), 'description': d}, logo, {'name': c_name, 'address': c_addr}, p_info, terms)
-                        st.session_state.pdf = pdf; file_name = f"{row['client_name']}_Invoice#{num}_{inv_date}.pdf"; st.session_state.inv_filename = file_name
-                        execute_statement("INSERT INTO invoices (user_id, project_id, invoice_num, amount, issue_date, description, tax) VALUES (:uid, :pid, :num, :amt, :dt, :desc, :tax)", {"uid": user_id, "pid": int(row['id']), "num": int(num), "amt": a+t, "dt": str(inv_date), "desc": d, "tax": t}); st.success(f"Invoice #{num} Generated")
+                        try: pdf = render_pdf(ar_pdf.generate_pdf_invoice, {'number': num, 'amount': a+t, 'tax': t, 'date': str(inv_date), 'description': d}, logo, {'name': c_name, 'address': c_addr}, p_info, terms)
+                        except ServerBusy as busy: st.warning(f"Invoice not saved. {busy}"); st.stop()
+                        keep_artifact("invoice_artifact", pdf, f"{row['client_name']}_Invoice#{num}_{inv_date}.pdf", "application/pdf")
+                        execute_statement("INSERT INTO invoices (user_id, project_id, invoice_num, amount, issue_date, description, tax) VALUES (:uid, :pid, :num, :amt, :dt, :desc, :tax) RETURNING id", {"uid": user_id, "pid": int(row['id']), "num": int(num), "amt": cents_to_decimal(a + t), "dt": str(inv_date), "desc": d, "tax": cents_to_decimal(t)},
+                                          event={"user_id": user_id, "event_type": "invoice.created", "project_id": int(row['id']), "amount_cents": a + t, "event_date": inv_date, "payload": {"invoice_num": int(num)}}); st.success(f"Invoice #{num} Generated")
                     else: st.error("Please verify details.")
-            if "pdf" in st.session_state:
-                fname = st.session_state.get("inv_filename", "invoice.pdf")
-                st.download_button("Download PDF", st.session_state.pdf, fname, "application/pdf")
+            artifact_download("invoice_artifact", "Download PDF")
             
             st.markdown("---")
             st.subheader("📜 Invoice History & Reprint")
-            hist_inv = run_query("SELECT invoice_num, issue_date, amount, tax, description FROM invoices WHERE project_id=:pid ORDER BY invoice_num DESC", {"pid": int(row['id'])})
-            if not hist_inv.empty:
-                st.dataframe(hist_inv[['invoice_num', 'issue_date', 'amount', 'description']], use_container_width=True)
+            @st.fragment
+            def invoice_reprint(row, hist_inv):
                 c_rep1, c_rep2 = st.columns([3, 2])
                 with c_rep1:
                     inv_to_print = st.selectbox("Select Invoice to Reprint", hist_inv['invoice_num'], key="reprint_sel")
@@ -1041,14 +1392,22 @@ else:
                     if inv_to_print:
                         rec = hist_inv[hist_inv['invoice_num'] == inv_to_print].iloc[0]
                         p_info_rep = {k: row[k] for k in ['name', 'client_name', 'billing_street', 'billing_city', 'billing_state', 'billing_zip', 'site_street', 'site_city', 'site_state', 'site_zip', 'po_number']}
-                        pdf_rep = generate_pdf_invoice({'number': rec['invoice_num'], 'amount': rec['amount'], 'tax': rec['tax'], 'date': str(rec['issue_date']), 'description': rec['description']}, logo, {'name': c_name, 'address': c_addr}, p_info_rep, terms)
-                        st.download_button(label=f"📥 Download PDF #{inv_to_print}", data=pdf_rep, file_name=f"Invoice_{rec['invoice_num']}_{row['client_name']}.pdf", mime="application/pdf")
+                        try:
+                            pdf_rep = render_pdf(ar_pdf.generate_pdf_invoice, {'number': rec['invoice_num'], 'amount': int(rec['amount']), 'tax': int(rec['tax']), 'date': str(rec['issue_date']), 'description': rec['description']}, logo, {'name': c_name, 'address': c_addr}, p_info_rep, terms)
+                            st.download_button(label=f"📥 Download PDF #{inv_to_print}", data=pdf_rep, file_name=f"Invoice_{rec['invoice_num']}_{row['client_name']}.pdf", mime="application/pdf")
+                        except ServerBusy as busy: st.warning(str(busy))
+                perf_caption("Reprint")
+
+            hist_inv = run_query(INVOICE_HISTORY_QUERY, {"uid": user_id, "pid": int(row['id'])}, replica=True)
+            if not hist_inv.empty:
+                st.dataframe(hist_inv[['invoice_num', 'issue_date', 'amount', 'description']].style.format(format_cents, subset=['amount']), use_container_width=True)
+                invoice_reprint(row, hist_inv)
             else:
                 st.info("No past invoices for this project.")
 
     elif page == "Payments":
         st.subheader("Log Payment")
-        projs = run_query("SELECT * FROM projects WHERE user_id=:id", {"id": user_id})
+        projs = run_query("SELECT * FROM projects WHERE user_id=:id AND is_archived = 0", {"id": user_id})
         if not projs.empty:
             p = st.selectbox("Project", projs['name']); row = projs[projs['name']==p].iloc[0]
             with st.form("pay_form", clear_on_submit=True):
@@ -1056,12 +1415,24 @@ else:
                 verified_pay = st.checkbox("Confirm Payment"); submitted_pay = st.form_submit_button("Log Payment")
                 if submitted_pay:
                     if verified_pay:
-                        amt = parse_currency(amt_str)
-                        execute_statement("INSERT INTO payments (user_id, project_id, amount, payment_date, notes) VALUES (:uid, :pid, :amt, :dt, :n)", {"uid": user_id, "pid": int(row['id']), "amt": amt, "dt": str(pay_date), "n": notes}); st.success("Payment Logged")
+                        amt = cents_to_decimal(to_cents(amt_str))
+                        execute_statement("INSERT INTO payments (user_id, project_id, amount, payment_date, notes) VALUES (:uid, :pid, :amt, :dt, :n) RETURNING id", {"uid": user_id, "pid": int(row['id']), "amt": amt, "dt": str(pay_date), "n": notes},
+                                          event={"user_id": user_id, "event_type": "payment.created", "project_id": int(row['id']), "amount_cents": to_cents(amt_str), "event_date": pay_date}); st.success("Payment Logged")
                     else: st.error("Please verify.")
             st.markdown("### Payment History")
-            hist = run_query("SELECT payment_date, amount, notes FROM payments WHERE project_id=:pid", {"pid": int(row['id'])})
-            st.dataframe(hist)
+            hist = run_query(PAYMENT_HISTORY_QUERY, {"uid": user_id, "pid": int(row['id'])}, replica=True)
+            if not hist.empty: st.dataframe(hist.style.format(format_cents, subset=['amount']))
+            else: st.info("No payments logged for this project.")
+
+    elif page == "Search":
+        st.subheader("Search")
+        term = st.text_input("Search invoices, projects and payment notes", placeholder="e.g. drywall smith")
+        if term.strip():
+            hits = search_records(user_id, term)
+            if not hits.empty:
+                st.caption(f"{len(hits)} best matches")
+                st.dataframe(hits.style.format(format_cents, subset=['amount']), use_container_width=True)
+            else: st.info("No matches found.")
 
     elif page == "Settings":
         st.header("Settings")
@@ -1075,3 +1446,21 @@ else:
                 if l: lb = l.read(); execute_statement("UPDATE users SET company_name=:cn, company_address=:ca, logo_data=:ld, terms_conditions=:tc WHERE id=:uid", {"cn": cn, "ca": ca, "ld": lb, "tc": t_cond, "uid": user_id})
                 else: execute_statement("UPDATE users SET company_name=:cn, company_address=:ca, terms_conditions=:tc WHERE id=:uid", {"cn": cn, "ca": ca, "tc": t_cond, "uid": user_id})
                 st.success("Profile Updated"); st.rerun()
+
+        st.markdown("---"); st.subheader("📤 Export Data")
+        st.caption("Full exports for your bookkeeper, streamed straight from the database. QuickBooks layout matches the QuickBooks Online import templates.")
+        ex1, ex2, ex3 = st.columns(3)
+        ex_kind = ex1.selectbox("Dataset", ["invoices", "payments", "projects", "ledger"], format_func=str.title, key="export_kind")
+        ex_fmt = ex2.selectbox("Format", ["csv", "xlsx"], format_func=str.upper, key="export_fmt")
+        ex_qb = ex3.checkbox("QuickBooks layout", key="export_qb")
+        if st.button("Prepare Export"):
+            import ar_export
+            try:
+                path = get_worker_pools()["export"].run(ar_export.write_export, get_db_url(), ex_kind, user_id, ex_fmt, ex_qb)
+                mime = "text/csv" if ex_fmt == "csv" else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                keep_artifact("export_artifact", path, f"{ex_kind}{'_quickbooks' if ex_qb else ''}_{datetime.date.today()}.{ex_fmt}", mime, from_file=True)
+            except ServerBusy as busy: st.warning(str(busy))
+        artifact_download("export_artifact", "Download Export")
+
+    perf_caption(page)
+    record_session_memory(page)
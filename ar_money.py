@@ -0,0 +1,29 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Money is carried as integer cents everywhere inside the app (Python ints / int64 columns) so sums and
+# running balances are exact and vectorisable. Convert only at the edges: SQL selects
+# ROUND(x * 100)::BIGINT, writes bind cents_to_decimal(), and screens/PDFs use format_cents().
+
+def to_cents(value):
+    if value is None: return 0
+    if isinstance(value, int): return value * 100
+    if isinstance(value, float):
+        if value != value: return 0  # NaN
+        value = repr(value)
+    clean = str(value).replace('$', '').replace(',', '').strip()
+    if not clean: return 0
+    try: return int((Decimal(clean) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError): return 0
+
+def cents_to_decimal(cents):
+    return (Decimal(int(cents)) / 100).quantize(Decimal('0.01'))
+
+def format_cents(cents, symbol=True):
+    cents = int(cents or 0)
+    text = f"{abs(cents) // 100:,}.{abs(cents) % 100:02d}"
+    if symbol: text = "$" + text
+    return "-" + text if cents < 0 else text
+
+def cents_sql(expr):
+    # DB edge of the money layer: NUMERIC dollars -> exact BIGINT cents.
+    return f"ROUND(coalesce({expr}, 0) * 100)::BIGINT"
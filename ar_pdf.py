@@ -0,0 +1,217 @@
+import datetime
+import io
+import os
+import tempfile
+from PIL import Image
+from fpdf import FPDF
+from ar_money import format_cents
+
+# PDF rendering for ProgressBill Pro. Kept out of ar_ledger_app.py so fpdf/PIL only load
+# on the first run that actually renders a document.
+
+BB_WATERMARK = "ProgressBill Pro | Powered by Balance & Build Consulting"
+
+def clean_text(text):
+    if not text: return ""
+    text = str(text)
+    replacements = {
+        '\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"',
+        '\u2013': '-', '\u2014': '-', '\u2026': '...', '\u00A0': ' '
+    }
+    for k, v in replacements.items(): text = text.replace(k, v)
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+class BB_PDF(FPDF):
+    def footer(self):
+        self.set_y(-15); self.set_font('Arial', 'I', 8); self.set_text_color(180, 180, 180); self.cell(0, 10, BB_WATERMARK, 0, 0, 'C')
+
+def generate_pdf_invoice(inv_data, logo_data, company_info, project_info, terms):
+    pdf = BB_PDF(); pdf.add_page(); pdf.set_auto_page_break(auto=True, margin=20)
+    if logo_data:
+        try:
+            image = Image.open(io.BytesIO(logo_data))
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
+                image.save(tmp, format="PNG"); tmp_path = tmp.name
+            pdf.image(tmp_path, 10, 10, 35); os.unlink(tmp_path)
+        except: pass
+    c_name_txt = clean_text(company_info.get('name', '')); c_addr_txt = clean_text(company_info.get('address', ''))
+    pdf.set_xy(120, 15); pdf.set_font("Arial", "B", 12); pdf.cell(0, 5, c_name_txt, ln=1, align='R')
+    pdf.set_font("Arial", size=10); pdf.multi_cell(0, 5, c_addr_txt, align='R')
+    pdf.set_xy(120, 35); pdf.set_font("Arial", "B", 16); pdf.set_text_color(43, 88, 141)
+    pdf.cell(0, 10, f"INVOICE #{inv_data['number']}", ln=1, align='R')
+    pdf.set_font("Arial", "B", 10); pdf.set_text_color(0, 0, 0); date_str = str(inv_data['date']) 
+    pdf.cell(0, 5, f"DATE: {date_str}", ln=1, align='R')
+    if project_info.get('po_number'): pdf.cell(0, 5, f"PO #: {clean_text(project_info['po_number'])}", ln=1, align='R')
+    pdf.set_xy(10, 60); pdf.set_font("Arial", "B", 10); pdf.cell(0, 5, "BILL TO:", ln=1)
+    pdf.set_font("Arial", size=10); pdf.cell(0, 5, clean_text(project_info['client_name']), ln=1)
+    if project_info.get('billing_street'): pdf.cell(0, 5, clean_text(project_info['billing_street']), ln=1); pdf.cell(0, 5, f"{clean_text(project_info['billing_city'])}, {clean_text(project_info['billing_state'])} {clean_text(project_info['billing_zip'])}", ln=1)
+    right_x = 110; current_y = 60; pdf.set_xy(right_x, current_y); pdf.set_font("Arial", "B", 10); pdf.cell(0, 5, "PROJECT SITE:"); current_y += 5; pdf.set_xy(right_x, current_y)
+    pdf.set_font("Arial", size=10); pdf.cell(0, 5, clean_text(project_info['name']))
+    if project_info.get('site_street'): current_y += 5; pdf.set_xy(right_x, current_y); pdf.cell(0, 5, clean_text(project_info['site_street'])); current_y += 5; pdf.set_xy(right_x, current_y); pdf.cell(0, 5, f"{clean_text(project_info['site_city'])}, {clean_text(project_info['site_state'])} {clean_text(project_info['site_zip'])}")
+    pdf.set_xy(10, 95); pdf.set_font("Arial", "B", 10); pdf.cell(0, 5, "DESCRIPTION:", ln=1); pdf.set_font("Arial", size=10); pdf.multi_cell(0, 5, clean_text(inv_data['description']))
+    pdf.ln(10); pdf.cell(0, 5, f"Subtotal: {format_cents(inv_data['amount'] - inv_data['tax'])}", ln=1, align='R'); pdf.cell(0, 5, f"Tax: {format_cents(inv_data['tax'])}", ln=1, align='R'); pdf.set_font("Arial", "B", 12); pdf.cell(0, 10, f"TOTAL: {format_cents(inv_data['amount'])}", border="T", ln=1, align='R')
+    if terms: pdf.ln(15); pdf.set_font("Arial", "B", 10); pdf.cell(0, 5, "TERMS & CONDITIONS:", ln=1); pdf.set_font("Arial", size=8); pdf.multi_cell(0, 4, clean_text(terms))
+    return pdf.output(dest='S').encode('latin-1', 'replace')
+
+def generate_statement_pdf(ledger_df, logo_data, company_info, project_name, client_name):
+    pdf = BB_PDF(); pdf.add_page()
+    if logo_data:
+        try:
+            image = Image.open(io.BytesIO(logo_data))
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
+                image.save(tmp, format="PNG"); tmp_path = tmp.name
+            pdf.image(tmp_path, 10, 10, 35); os.unlink(tmp_path)
+        except: pass
+    pdf.set_xy(120, 15); pdf.set_font("Arial", "B", 16); pdf.set_text_color(43, 88, 141); pdf.cell(0, 10, "PROJECT STATEMENT", ln=1, align='R')
+    pdf.set_font("Arial", size=10); pdf.set_text_color(0, 0, 0); pdf.cell(0, 5, f"Date: {datetime.date.today()}", ln=1, align='R'); pdf.ln(10)
+    pdf.set_font("Arial", "B", 12); pdf.cell(0, 5, f"Project: {clean_text(project_name)}", ln=1); pdf.set_font("Arial", size=10); pdf.cell(0, 5, f"Client: {clean_text(client_name)}", ln=1); pdf.ln(10)
+    pdf.set_fill_color(43, 88, 141); pdf.set_text_color(255, 255, 255); pdf.set_font("Arial", "B", 10)
+    pdf.cell(30, 8, "Date", 1, 0, 'C', 1); pdf.cell(80, 8, "Description", 1, 0, 'L', 1); pdf.cell(25, 8, "Charge", 1, 0, 'R', 1); pdf.cell(25, 8, "Payment", 1, 0, 'R', 1); pdf.cell(30, 8, "Balance", 1, 1, 'R', 1)
+    pdf.set_text_color(0, 0, 0); pdf.set_font("Arial", size=9); fill = False
+    for index, row in ledger_df.iterrows():
+        if fill: pdf.set_fill_color(240, 240, 240)
+        else: pdf.set_fill_color(255, 255, 255)
+        pdf.cell(30, 8, str(row['Date']), 1, 0, 'C', fill); pdf.cell(80, 8, clean_text(str(row['Details'])[:40]), 1, 0, 'L', fill); pdf.cell(25, 8, format_cents(row['Charge']), 1, 0, 'R', fill); pdf.cell(25, 8, format_cents(row['Payment']), 1, 0, 'R', fill); pdf.cell(30, 8, format_cents(row['Balance']), 1, 1, 'R', fill); fill = not fill
+    return pdf.output(dest='S').encode('latin-1', 'replace')
+
+def generate_dashboard_pdf(metrics, company_name, logo_data, chart_data):
+    pdf = BB_PDF()
+    pdf.add_page()
+    
+    # Logo
+    if logo_data:
+        try:
+            image = Image.open(io.BytesIO(logo_data))
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
+                image.save(tmp, format="PNG")
+                tmp_path = tmp.name
+            pdf.image(tmp_path, 10, 10, 35)
+            os.unlink(tmp_path)
+        except:
+            pass
+
+    # Header
+    pdf.set_xy(50, 15)
+    pdf.set_font("Arial", "B", 16)
+    pdf.set_text_color(43, 88, 141) # Brand Blue
+    pdf.cell(0, 10, f"EXECUTIVE DASHBOARD REPORT", ln=1, align='R')
+    
+    pdf.set_font("Arial", size=10)
+    pdf.set_text_color(0, 0, 0)
+    pdf.cell(0, 5, f"Company: {clean_text(company_name)}", ln=1, align='R')
+    pdf.cell(0, 5, f"Date: {datetime.date.today()}", ln=1, align='R')
+    pdf.ln(15)
+
+    # Metrics Section
+    pdf.set_font("Arial", "B", 14)
+    pdf.set_text_color(43, 88, 141)
+    pdf.cell(0, 10, "FINANCIAL SNAPSHOT", ln=1)
+    pdf.ln(2)
+    
+    pdf.set_font("Arial", size=12)
+    pdf.set_text_color(0, 0, 0)
+    
+    # Draw a simple table or list for metrics
+    for key, value in metrics.items():
+        pdf.set_font("Arial", "B", 11)
+        pdf.cell(60, 8, clean_text(key), 1)
+        pdf.set_font("Arial", size=11)
+        pdf.cell(40, 8, clean_text(str(value)), 1, 1, 'R')
+        
+    pdf.ln(10)
+    
+    # Chart Data Summary (Breakdown)
+    pdf.set_font("Arial", "B", 14)
+    pdf.set_text_color(43, 88, 141)
+    pdf.cell(0, 10, "BREAKDOWN", ln=1)
+    pdf.ln(2)
+    
+    pdf.set_font("Arial", size=11)
+    pdf.set_text_color(0, 0, 0)
+    
+    # Table Header
+    pdf.cell(60, 8, "Category", 1, 0, 'C', fill=False)
+    pdf.cell(40, 8, "Amount ($)", 1, 1, 'R', fill=False)
+    
+    for cat, amt in chart_data.items():
+        pdf.cell(60, 8, clean_text(cat), 1)
+        pdf.cell(40, 8, format_cents(amt, symbol=False), 1, 1, 'R')
+
+    return pdf.output(dest='S').encode('latin-1', 'replace')
+
+# Client statement table: (header, width, align) per column; rows arrive as
+# (date, project, details, charge, payment, project_balance, balance) tuples, amounts in cents.
+CLIENT_STATEMENT_COLS = [("Date", 22, 'C'), ("Project", 38, 'L'), ("Description", 56, 'L'), ("Charge", 24, 'R'), ("Payment", 24, 'R'), ("Balance", 26, 'R')]
+
+def _client_table_header(pdf):
+    pdf.set_fill_color(43, 88, 141); pdf.set_text_color(255, 255, 255); pdf.set_font("Arial", "B", 9)
+    for title, width, align in CLIENT_STATEMENT_COLS: pdf.cell(width, 7, title, 1, 0, align, 1)
+    pdf.ln(); pdf.set_text_color(0, 0, 0); pdf.set_font("Arial", size=8)
+
+def generate_client_statement_pdf(rows, logo_data, company_info, client_name, start_date, end_date, opening_balances=None):
+    # `rows` may be any iterator (e.g. a streaming DB cursor): each row is written and dropped, and
+    # only the per-project subtotals are kept, so memory does not grow with the number of lines.
+    # `opening_balances` maps project id -> (name, balance in cents before the period); projects carrying a
+    # balance appear in the subtotals even without activity in the period. Subtotals are keyed by project id,
+    # so two projects sharing a name stay on separate lines.
+    pdf = BB_PDF(); pdf.add_page(); pdf.set_auto_page_break(auto=True, margin=20)
+    if logo_data:
+        try:
+            image = Image.open(io.BytesIO(logo_data))
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
+                image.save(tmp, format="PNG"); tmp_path = tmp.name
+            pdf.image(tmp_path, 10, 10, 35); os.unlink(tmp_path)
+        except: pass
+    pdf.set_xy(120, 15); pdf.set_font("Arial", "B", 16); pdf.set_text_color(43, 88, 141); pdf.cell(0, 10, "CLIENT STATEMENT", ln=1, align='R')
+    pdf.set_font("Arial", size=10); pdf.set_text_color(0, 0, 0)
+    pdf.cell(0, 5, clean_text(company_info.get('name', '')), ln=1, align='R')
+    pdf.cell(0, 5, f"Period: {start_date} to {end_date}", ln=1, align='R'); pdf.cell(0, 5, f"Date: {datetime.date.today()}", ln=1, align='R'); pdf.ln(8)
+    pdf.set_font("Arial", "B", 12); pdf.cell(0, 5, f"Client: {clean_text(client_name)}", ln=1); pdf.ln(5)
+
+    opening_balances = opening_balances or {}
+    subtotals = {pid: [name, 0, 0, bal] for pid, (name, bal) in opening_balances.items() if bal}
+    opening = closing = sum(bal for name, bal in opening_balances.values()); fill = False; activity = False
+    _client_table_header(pdf)
+    pdf.set_font("Arial", "I", 8); pdf.cell(sum(c[1] for c in CLIENT_STATEMENT_COLS[:-1]), 6, "Balance forward", 1, 0, 'L'); pdf.cell(CLIENT_STATEMENT_COLS[-1][1], 6, format_cents(opening), 1, 1, 'R'); pdf.set_font("Arial", size=8)
+    for tx_date, project, details, charge, payment, project_balance, balance, project_id in rows:
+        charge, payment = charge or 0, payment or 0; activity = True
+        if pdf.get_y() + 6 > pdf.page_break_trigger:
+            pdf.add_page(); _client_table_header(pdf)
+        if fill: pdf.set_fill_color(240, 240, 240)
+        else: pdf.set_fill_color(255, 255, 255)
+        values = [str(tx_date), clean_text(project)[:22], clean_text(details)[:34], format_cents(charge), format_cents(payment), format_cents(balance)]
+        for (title, width, align), value in zip(CLIENT_STATEMENT_COLS, values): pdf.cell(width, 6, value, 1, 0, align, fill)
+        pdf.ln(); fill = not fill
+        sub = subtotals.setdefault(project_id, [project, 0, 0, 0])
+        sub[1] += charge; sub[2] += payment; sub[3] = project_balance; closing = balance
+
+    if not activity:
+        pdf.set_font("Arial", "I", 10); pdf.cell(0, 8, "No activity in this period.", ln=1)
+
+    pdf.ln(6)
+    if subtotals and pdf.get_y() + 14 + 7 * len(subtotals) > pdf.page_break_trigger: pdf.add_page()
+    if subtotals:
+        pdf.set_font("Arial", "B", 11); pdf.set_text_color(43, 88, 141); pdf.cell(0, 8, "PROJECT SUBTOTALS", ln=1); pdf.set_text_color(0, 0, 0)
+        pdf.set_font("Arial", "B", 9)
+        pdf.cell(80, 7, "Project", 1, 0, 'L'); pdf.cell(35, 7, "Charges", 1, 0, 'R'); pdf.cell(35, 7, "Payments", 1, 0, 'R'); pdf.cell(40, 7, "Project Balance", 1, 1, 'R')
+        pdf.set_font("Arial", size=9)
+    for project, charges, payments, project_balance in subtotals.values():
+        if pdf.get_y() + 7 > pdf.page_break_trigger: pdf.add_page()
+        pdf.cell(80, 7, clean_text(project)[:45], 1, 0, 'L'); pdf.cell(35, 7, format_cents(charges), 1, 0, 'R'); pdf.cell(35, 7, format_cents(payments), 1, 0, 'R'); pdf.cell(40, 7, format_cents(project_balance), 1, 1, 'R')
+    pdf.ln(4); pdf.set_font("Arial", "B", 12); pdf.cell(0, 10, f"TOTAL BALANCE DUE: {format_cents(closing)}", border="T", ln=1, align='R')
+    return pdf.output(dest='S').encode('latin-1', 'replace')
+
+def render_client_statement(db_url, sql, params, logo_data, company_info, client_name, start_date, end_date, opening_sql=None):
+    # Runs inside a PDF worker process: it opens its own short-lived connection and streams the
+    # windowed ledger query straight into the PDF instead of shipping rows across processes.
+    # `opening_sql` (ar_queries.opening_balance_query) supplies the per-project balance forward.
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.pool import NullPool
+    engine = create_engine(db_url, poolclass=NullPool)
+    try:
+        with engine.connect() as conn:
+            opening = {pid: (name, bal) for pid, name, bal in conn.execute(text(opening_sql), params)} if opening_sql and params.get("start") else {}
+            result = conn.execution_options(stream_results=True, max_row_buffer=1000).execute(text(sql), params)
+            return generate_client_statement_pdf(result, logo_data, company_info, client_name, start_date, end_date, opening)
+    finally:
+        engine.dispose()
@@ -0,0 +1,122 @@
+from ar_money import cents_sql
+
+# SQL shared by the Streamlit app and the ar_jobs batch commands.
+
+# Full-text search vectors (shared by the GIN indexes and search_records)
+# Format with t="" for the index, or a table alias such as t="i." inside queries.
+PROJECT_SEARCH_VECTOR = "to_tsvector('english', coalesce({t}name, '') || ' ' || coalesce({t}client_name, '') || ' ' || coalesce({t}scope_of_work, '') || ' ' || coalesce({t}scope, ''))"
+INVOICE_SEARCH_VECTOR = "to_tsvector('english', coalesce({t}description, ''))"
+PAYMENT_SEARCH_VECTOR = "to_tsvector('english', coalesce({t}notes, ''))"
+
+# Ranked search over one tenant's invoices, payments and projects (:uid, :term, :lim). Any search word may match;
+# rows matching more words (or whose project also matches) rank higher.
+SEARCH_QUERY = f"""
+    WITH q AS (SELECT replace(plainto_tsquery('english', :term)::text, '&', '|')::tsquery AS query)
+    SELECT kind, project, client, date, reference, amount, details FROM (
+        SELECT 'Invoice' AS kind, p.name AS project, p.client_name AS client, i.issue_date AS date,
+               'Invoice #' || i.invoice_num AS reference, {cents_sql('i.amount')} AS amount, i.description AS details,
+               ts_rank({INVOICE_SEARCH_VECTOR.format(t="i.")}, q.query) + ts_rank({PROJECT_SEARCH_VECTOR.format(t="p.")}, q.query) AS rank
+        FROM invoices i JOIN projects p ON p.id = i.project_id, q
+        WHERE i.user_id = :uid AND {INVOICE_SEARCH_VECTOR.format(t="i.")} @@ q.query
+        UNION ALL
+        SELECT 'Payment', p.name, p.client_name, pay.payment_date, 'Payment', {cents_sql('pay.amount')}, pay.notes,
+               ts_rank({PAYMENT_SEARCH_VECTOR.format(t="pay.")}, q.query) + ts_rank({PROJECT_SEARCH_VECTOR.format(t="p.")}, q.query)
+        FROM payments pay JOIN projects p ON p.id = pay.project_id, q
+        WHERE pay.user_id = :uid AND {PAYMENT_SEARCH_VECTOR.format(t="pay.")} @@ q.query
+        UNION ALL
+        SELECT 'Project', p.name, p.client_name, p.start_date, p.status, {cents_sql('p.quoted_price')}, coalesce(p.scope_of_work, p.scope),
+               ts_rank({PROJECT_SEARCH_VECTOR.format(t="p.")}, q.query) * 2
+        FROM projects p, q
+        WHERE p.user_id = :uid AND {PROJECT_SEARCH_VECTOR.format(t="p.")} @@ q.query
+    ) hits
+    ORDER BY rank DESC, date DESC NULLS LAST
+    LIMIT :lim
+"""
+
+def ledger_query(project_filter, group_by=None):
+    # One windowed query for a running ledger over the projects matched by `project_filter` (alias p).
+    # Amounts are cents. Balances are computed over all history before the optional :start/:end window is applied.
+    # project_id follows the balances so consumers can tell same-named projects apart.
+    # `group_by` (a projects column, e.g. "client_name") restarts the running balance per group and returns the
+    # group value as an extra last column, so a batch job can build many statements from one query.
+    grp = f"p.{group_by}" if group_by else "NULL"
+    return f"""
+        WITH tx AS (
+            SELECT p.id AS project_id, {grp} AS grp, p.name AS project, i.issue_date AS tx_date, 0 AS kind, i.id AS tx_id,
+                   'Invoice #' || i.invoice_num AS details, {cents_sql('i.amount')} AS charge, 0 AS payment
+            FROM invoices i JOIN projects p ON p.id = i.project_id
+            WHERE i.user_id = :uid AND p.user_id = :uid AND {project_filter}
+            UNION ALL
+            SELECT p.id, {grp}, p.name, pay.payment_date, 1, pay.id,
+                   'Payment (' || coalesce(pay.notes, '') || ')', 0, {cents_sql('pay.amount')}
+            FROM payments pay JOIN projects p ON p.id = pay.project_id
+            WHERE pay.user_id = :uid AND p.user_id = :uid AND {project_filter}
+        ), ledger AS (
+            SELECT tx.*,
+                   (SUM(charge - payment) OVER (PARTITION BY project_id ORDER BY tx_date, kind, tx_id))::BIGINT AS project_balance,
+                   (SUM(charge - payment) OVER (PARTITION BY grp ORDER BY tx_date, kind, tx_id, project_id))::BIGINT AS balance
+            FROM tx
+        )
+        SELECT tx_date, project, details, charge, payment, project_balance, balance, project_id{', grp' if group_by else ''} FROM ledger
+        WHERE (CAST(:start AS DATE) IS NULL OR tx_date >= CAST(:start AS DATE))
+          AND (CAST(:end AS DATE) IS NULL OR tx_date <= CAST(:end AS DATE))
+        ORDER BY tx_date, kind, tx_id, project_id
+    """
+
+def opening_balance_query(project_filter):
+    # Companion to ledger_query for statements: each matched project's balance (cents) before :start,
+    # so a period with no activity still shows its balance forward and amount due.
+    return f"""
+        SELECT p.id AS project_id, p.name AS project, SUM(t.amount)::BIGINT AS balance
+        FROM (
+            SELECT i.project_id, i.issue_date AS tx_date, {cents_sql('i.amount')} AS amount FROM invoices i WHERE i.user_id = :uid
+            UNION ALL
+            SELECT pay.project_id, pay.payment_date, -{cents_sql('pay.amount')} FROM payments pay WHERE pay.user_id = :uid
+        ) t JOIN projects p ON p.id = t.project_id
+        WHERE p.user_id = :uid AND {project_filter} AND t.tx_date < CAST(:start AS DATE)
+        GROUP BY p.id, p.name
+        ORDER BY p.name, p.id
+    """
+
+# --- Per-tenant page queries over invoices/payments ---
+# Each filters invoices and payments by :uid itself (not only through projects), so on HASH(user_id)-partitioned
+# tables every one prunes to the tenant's partition; ar_jobs.explain_pruning() checks them all.
+
+# Billing trend buckets (:grain is 'month' or 'quarter'); amounts are cents.
+BILLING_TREND_QUERY = f"""
+    SELECT date_trunc(:grain, t.tx_date)::date AS period, coalesce(p.status, 'Unknown') AS status,
+           SUM(t.invoiced)::BIGINT AS invoiced, SUM(t.collected)::BIGINT AS collected
+    FROM (
+        SELECT project_id, issue_date AS tx_date, {cents_sql('amount')} AS invoiced, 0 AS collected FROM invoices WHERE user_id = :uid
+        UNION ALL
+        SELECT project_id, payment_date, 0, {cents_sql('amount')} FROM payments WHERE user_id = :uid
+    ) t JOIN projects p ON p.id = t.project_id
+    WHERE t.tx_date IS NOT NULL
+    GROUP BY 1, 2
+"""
+
+# Cash-flow forecast inputs: active projects with what has been billed so far, and the average days from an
+# invoice to the payment that follows it.
+FORECAST_PROJECTS_QUERY = f"""
+    SELECT p.id, {cents_sql('p.quoted_price')} AS quoted_price, p.start_date, p.duration_days, p.non_working_days, p.retainage_percent,
+           coalesce(b.billed, 0) AS billed
+    FROM projects p
+    LEFT JOIN (SELECT project_id, SUM({cents_sql('amount')}) AS billed FROM invoices WHERE user_id = :uid GROUP BY project_id) b ON b.project_id = p.id
+    WHERE p.user_id = :uid AND p.is_archived = 0 AND p.status IN ('Pre-Construction', 'Course of Construction')
+"""
+DAYS_TO_PAY_QUERY = """
+    SELECT AVG(pay.payment_date - (SELECT MAX(i.issue_date) FROM invoices i
+                                   WHERE i.user_id = :uid AND i.project_id = pay.project_id AND i.issue_date <= pay.payment_date))
+    FROM payments pay WHERE pay.user_id = :uid
+"""
+
+NEXT_INVOICE_NUMBER_QUERY = "SELECT MAX(invoice_num) FROM invoices WHERE user_id = :uid"
+INVOICE_HISTORY_QUERY = f"SELECT invoice_num, issue_date, {cents_sql('amount')} AS amount, {cents_sql('tax')} AS tax, description FROM invoices WHERE user_id = :uid AND project_id = :pid ORDER BY invoice_num DESC"
+PAYMENT_HISTORY_QUERY = f"SELECT payment_date, {cents_sql('amount')} AS amount, notes FROM payments WHERE user_id = :uid AND project_id = :pid"
+
+# One statement, one transaction: children go with the project (the FK cascade covers other writers too).
+DELETE_PROJECT_QUERY = """
+    WITH del_inv AS (DELETE FROM invoices WHERE project_id = :pid AND user_id = :uid),
+         del_pay AS (DELETE FROM payments WHERE project_id = :pid AND user_id = :uid)
+    DELETE FROM projects WHERE id = :pid AND user_id = :uid RETURNING id
+"""
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+# Bounded executors shared by every session in a server process. Callers only need to handle ServerBusy:
+# it covers a full queue, a job that outlives the pool's timeout, and a worker process that died.
+
+class ServerBusy(Exception):
+    pass
+
+class BoundedPool:
+    def __init__(self, name, factory, max_pending, timeout=60):
+        self.name, self.factory, self.max_pending, self.timeout = name, factory, max_pending, timeout
+        self.executor = factory()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.stats = {"submitted": 0, "rejected": 0, "failed": 0, "timed_out": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    def run(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise ServerBusy("The server is busy right now. Please try again in a moment.")
+            self.pending += 1
+            self.stats["submitted"] += 1
+        started = time.perf_counter()
+        try:
+            try:
+                future = self.executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self.executor = self.factory()
+                future = self.executor.submit(fn, *args)
+        except Exception:
+            # Never submitted, so no done-callback will release the slot.
+            with self.lock:
+                self.pending -= 1
+                self.stats["failed"] += 1
+            raise
+        future.add_done_callback(lambda f: self._finished(f, started))
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeout:
+            # The job keeps its slot until the worker actually finishes; the caller just stops waiting.
+            future.cancel()
+            with self.lock: self.stats["timed_out"] += 1
+            raise ServerBusy("That is taking longer than expected. Please try again in a moment.")
+        except BrokenProcessPool:
+            self.executor = self.factory()
+            raise ServerBusy("A background worker restarted. Please try again.")
+
+    def _finished(self, future, started):
+        elapsed = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.pending -= 1
+            self.stats["total_ms"] += elapsed
+            self.stats["max_ms"] = max(self.stats["max_ms"], elapsed)
+            if future.cancelled() or future.exception(): self.stats["failed"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            done = self.stats["submitted"] - self.pending
+            return {"Pool": self.name, "In Flight": self.pending, "Limit": self.max_pending, "Submitted": self.stats["submitted"],
+                    "Rejected": self.stats["rejected"], "Timed Out": self.stats["timed_out"], "Failed": self.stats["failed"],
+                    "Avg ms": round(self.stats["total_ms"] / done, 1) if done else 0.0, "Max ms": round(self.stats["max_ms"], 1)}
+
+def make_worker_pools():
+    # One set per server process (the app caches it); bench/load_pools.py builds the same pools.
+    cpus = os.cpu_count() or 2
+    pdf_workers = int(os.environ.get("PDF_WORKERS", max(1, min(cpus, 4))))
+    auth_workers = int(os.environ.get("AUTH_WORKERS", max(2, cpus)))
+    export_workers = int(os.environ.get("EXPORT_WORKERS", 2))
+    # Logins come in bursts (a whole crew opening the app at 7am) and a bcrypt check takes a few hundred ms,
+    # so a burst should queue briefly rather than be turned away: allow a deep queue and a generous wait.
+    auth_queue = int(os.environ.get("AUTH_QUEUE", max(64, auth_workers * 32)))
+    auth_timeout = float(os.environ.get("AUTH_TIMEOUT_SECONDS", 60))
+    # bcrypt releases the GIL, so threads parallelise it; FPDF is pure Python and needs processes.
+    # spawn (not fork) because the Streamlit server is multi-threaded.
+    return {
+        "auth": BoundedPool("auth", lambda: ThreadPoolExecutor(auth_workers, thread_name_prefix="bcrypt"), auth_queue, timeout=auth_timeout),
+        "pdf": BoundedPool("pdf", lambda: ProcessPoolExecutor(pdf_workers, mp_context=multiprocessing.get_context("spawn")), pdf_workers * 4),
+        # Full-tenant exports are long-running, so they get their own small pool and do not starve PDFs.
+        "export": BoundedPool("export", lambda: ProcessPoolExecutor(export_workers, mp_context=multiprocessing.get_context("spawn")), export_workers * 2, timeout=900),
+    }
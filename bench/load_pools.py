@@ -0,0 +1,102 @@
+"""Load test for the shared worker pools (ar_workers.make_worker_pools).
+
+Simulates N concurrent sessions, each doing a login (bcrypt check on the auth pool) followed by
+invoice PDF renders (ar_pdf on the spawn process pool), using the same pools the app builds.
+Each session is a Streamlit AppTest script run, so the reported latency is the whole rerun as a user
+sees it (script execution plus waiting on the pools), not just the pool call.
+Reports p50/p95/max rerun latency per step and how many reruns were turned away with ServerBusy.
+
+Usage (from the repo root):
+    python bench/load_pools.py [--sessions 50] [--invoices 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bcrypt
+from streamlit.testing.v1 import AppTest
+import ar_pdf
+from ar_workers import make_worker_pools
+
+INVOICE = {'number': 1001, 'amount': 1234567, 'tax': 45600, 'date': '2026-10-01', 'description': 'Progress billing for framing and rough-in ' * 4}
+PROJECT = {k: "Sample" for k in ['name', 'client_name', 'billing_street', 'billing_city', 'billing_state', 'billing_zip', 'site_street', 'site_city', 'site_state', 'site_zip', 'po_number']}
+
+# The login and invoice reruns, reduced to what they cost: a bcrypt check and a PDF render on the shared pools.
+# Pools and fixtures come in through a module so every AppTest session shares one set, like the app's cache_resource.
+SCRIPT = '''
+import bcrypt
+import streamlit as st
+import ar_pdf
+from ar_workers import ServerBusy
+from load_pools import POOLS, HASHED, INVOICE, PROJECT
+
+if st.button("Login"):
+    try:
+        ok = POOLS["auth"].run(lambda p, h: bcrypt.checkpw(p.encode(), h.encode()), "correct horse", HASHED)
+        st.session_state.logged_in = ok
+    except ServerBusy as busy: st.warning(str(busy))
+if st.session_state.get("logged_in") and st.button("Invoice"):
+    try:
+        pdf = POOLS["pdf"].run(ar_pdf.generate_pdf_invoice, INVOICE, None, {"name": "Acme", "address": ""}, PROJECT, "")
+        st.download_button("Download", pdf, file_name="invoice.pdf")
+    except ServerBusy as busy: st.warning(str(busy))
+'''
+
+POOLS = make_worker_pools()
+HASHED = bcrypt.hashpw(b"correct horse", bcrypt.gensalt()).decode()
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--invoices", type=int, default=3, help="Invoice renders per session")
+    args = parser.parse_args()
+
+    sys.modules.setdefault("load_pools", sys.modules[__name__])  # so SCRIPT sees these POOLS, not a second copy
+    POOLS["pdf"].run(ar_pdf.generate_pdf_invoice, INVOICE, None, {"name": "Acme", "address": ""}, PROJECT, "")  # warm the worker processes
+
+    timings = {"login": [], "invoice": []}
+    busy = {"login": 0, "invoice": 0}
+    lock = threading.Lock()
+    start_gate = threading.Barrier(args.sessions)
+
+    def rerun(kind, at, label):
+        t = time.perf_counter()
+        at = next(b for b in at.button if b.label == label).click().run()
+        elapsed = (time.perf_counter() - t) * 1000
+        with lock:
+            if at.warning: busy[kind] += 1
+            else: timings[kind].append(elapsed)
+        return at
+
+    def session(at):
+        start_gate.wait()
+        at = rerun("login", at, "Login")
+        if "logged_in" not in at.session_state or not at.session_state["logged_in"]: return
+        for _ in range(args.invoices): at = rerun("invoice", at, "Invoice")
+
+    # First (logged-out) runs happen one at a time; only the timed reruns overlap.
+    apps = [AppTest.from_string(SCRIPT, default_timeout=600).run() for _ in range(args.sessions)]
+    started = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(at,)) for at in apps]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - started
+
+    limits = ", ".join(f"{k} queue {POOLS[k].max_pending}" for k in ("auth", "pdf"))
+    print(f"{args.sessions} sessions, {limits}, wall {wall:.1f}s")
+    for kind, values in timings.items():
+        if values: print(f"{kind:<8} ok {len(values):4d}  busy {busy[kind]:4d}  p50 {statistics.median(values):8.1f} ms  p95 {percentile(values, 95):8.1f} ms  max {max(values):8.1f} ms")
+        else: print(f"{kind:<8} ok    0  busy {busy[kind]:4d}")
+    for pool in POOLS.values():
+        if pool.executor: pool.executor.shutdown()
+
+if __name__ == "__main__":
+    main()
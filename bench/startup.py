@@ -0,0 +1,54 @@
+"""Cold-start benchmark for the Streamlit app.
+
+Each sample runs in a fresh interpreter so nothing is warm in sys.modules:
+  * import: wall time to import the modules ar_ledger_app.py loads at top level
+  * first paint: AppTest run of the whole script up to the login screen
+
+Usage (from the repo root, with .streamlit/secrets.toml or SUPABASE_DB_URL available):
+    python bench/startup.py [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import time; t = time.perf_counter()
+import streamlit, pandas, numpy, bcrypt, sqlalchemy, ar_money, ar_queries, ar_events, ar_jobs, ar_artifacts
+print((time.perf_counter() - t) * 1000)
+"""
+
+PAINT_PROBE = """
+import time; t = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("ar_ledger_app.py", default_timeout=120).run()
+assert not at.exception, at.exception
+print((time.perf_counter() - t) * 1000)
+"""
+
+# Libraries the app used to import eagerly; reported so a regression back to top-level imports is visible.
+DEFERRED = ["stripe", "altair", "supabase", "spellchecker", "fpdf", "PIL.Image", "ar_pdf"]
+
+def sample(code):
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+def report(label, values):
+    values = sorted(values)
+    print(f"{label:<28} median {statistics.median(values):8.1f} ms   min {values[0]:8.1f} ms   max {values[-1]:8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    report("top-level imports", [sample(IMPORT_PROBE) for _ in range(args.runs)])
+    report("first paint (login screen)", [sample(PAINT_PROBE) for _ in range(args.runs)])
+    for mod in DEFERRED:
+        try: report(f"  deferred: {mod}", [sample(f"import time; t = time.perf_counter(); import {mod}; print((time.perf_counter() - t) * 1000)") for _ in range(args.runs)])
+        except subprocess.CalledProcessError: print(f"  deferred: {mod:<16} not installed")
+
+if __name__ == "__main__":
+    main()
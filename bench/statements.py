@@ -0,0 +1,81 @@
+"""Throughput of the month-end statement pipeline (ar_jobs.py statements) per client.
+
+Renders a project statement PDF, builds the email and sends it through ar_jobs.SMTPSender, N times,
+and reports statements per minute for rendering, sending and the whole pipeline. The database read is
+not included (it is one windowed query per tenant, shared by all of that tenant's clients).
+
+Mail goes to SMTP_HOST:SMTP_PORT if set, otherwise to an in-process SMTP sink that accepts and
+discards everything. --rate is the production pacing (default 0 = unpaced, to measure the ceiling).
+
+Usage (from the repo root):
+    python bench/statements.py [--statements 200] [--rows 24] [--rate 0]
+"""
+import argparse
+import datetime
+import os
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pandas as pd
+import ar_pdf
+from ar_jobs import SMTPSender, build_statement_message
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(b"220 sink\r\n")
+        for line in self.rfile:
+            verb = line[:4].upper()
+            if verb == b"DATA":
+                self.wfile.write(b"354 go ahead\r\n")
+                for body in iter(self.rfile.readline, b".\r\n"): pass
+                self.wfile.write(b"250 queued\r\n")
+            elif verb == b"QUIT": self.wfile.write(b"221 bye\r\n"); return
+            else: self.wfile.write(b"250 ok\r\n")
+
+def sample_ledger(rows):
+    day = datetime.date(2026, 1, 5); balance = 0; data = []
+    for n in range(rows):
+        charge, payment = (1250000, 0) if n % 2 == 0 else (0, 1000000)
+        balance += charge - payment
+        data.append({"Date": day + datetime.timedelta(days=14 * n), "Details": f"Invoice #{1000 + n}" if charge else "Payment (Check)",
+                     "Charge": charge, "Payment": payment, "Balance": balance})
+    return pd.DataFrame(data)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--statements", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=24, help="Ledger lines per statement")
+    parser.add_argument("--rate", type=float, default=0, help="Sender pacing in messages per minute (0 = unpaced)")
+    args = parser.parse_args()
+
+    host, port = os.environ.get("SMTP_HOST"), int(os.environ.get("SMTP_PORT", "1025"))
+    if not host:
+        sink = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SinkHandler); sink.daemon_threads = True
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        host, port = "127.0.0.1", sink.server_address[1]
+    sender = SMTPSender(host, port, rate=args.rate, backoff=0)
+    tenant = {"company_name": "Acme Builders", "username": "acme", "email": "office@acme.test"}
+    ledger = sample_ledger(args.rows)
+
+    render = send = 0.0
+    started = time.perf_counter()
+    for n in range(args.statements):
+        t0 = time.perf_counter()
+        pdf_bytes = ar_pdf.generate_statement_pdf(ledger, None, {"name": "Acme Builders"}, "Sample Project", f"Client {n}")
+        msg = build_statement_message("statements@progressbill.local", tenant, f"Client {n}", f"client{n}@example.test", "2026-09", int(ledger["Balance"].iloc[-1]), pdf_bytes)
+        t1 = time.perf_counter()
+        sender.send(msg)
+        render += t1 - t0; send += time.perf_counter() - t1
+    total = time.perf_counter() - started
+    sender.close()
+
+    print(f"{args.statements} statements, {args.rows} lines each, {len(pdf_bytes):,} byte PDF")
+    print(f"render+build: {args.statements / render * 60:,.0f}/min ({render / args.statements * 1000:.1f} ms each)")
+    print(f"smtp send:    {args.statements / send * 60:,.0f}/min ({send / args.statements * 1000:.1f} ms each)")
+    print(f"pipeline:     {args.statements / total * 60:,.0f}/min")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from ar_forecast import parse_date_list, spread_forecast
+
+TODAY = datetime.date(2026, 1, 5)  # a Monday
+
+
+def projects(*rows):
+    defaults = {"quoted_price": 1_000_000, "billed": 0, "start_date": TODAY, "duration_days": 14, "non_working_days": "[]", "retainage_percent": 0}
+    return pd.DataFrame([{**defaults, **row} for row in rows])
+
+
+def weekly(frame, column):
+    return [round(v, 2) for v in frame[column]]
+
+
+def test_spreads_evenly_over_working_days():
+    fc = spread_forecast(projects({}), lag=0, weeks=4, today=TODAY)
+    assert list(fc["week"]) == list(pd.to_datetime(["2026-01-05", "2026-01-12", "2026-01-19", "2026-01-26"]))
+    assert weekly(fc, "billings") == [5000.0, 5000.0, 0.0, 0.0]
+    assert weekly(fc, "collections") == [5000.0, 5000.0, 0.0, 0.0]
+
+
+def test_non_working_days_are_skipped():
+    # Wednesday off leaves 9 working days; a Saturday "off" day changes nothing.
+    fc = spread_forecast(projects({"non_working_days": '["2026-01-07", "2026-01-10"]'}), lag=0, weeks=3, today=TODAY)
+    assert weekly(fc, "billings") == [round(4 * 10000 / 9, 2), round(5 * 10000 / 9, 2), 0.0]
+    assert fc["billings"].sum() == pytest.approx(10000)
+
+
+def test_bad_non_working_days_are_ignored():
+    fc = spread_forecast(projects({"non_working_days": '["not a date"]'}, {"non_working_days": "{oops"}), lag=0, weeks=2, today=TODAY)
+    assert weekly(fc, "billings") == [10000.0, 10000.0]
+
+
+def test_overdue_project_bills_remaining_balance_next_business_day():
+    saturday = datetime.date(2026, 1, 10)
+    fc = spread_forecast(projects({"start_date": datetime.date(2025, 10, 1), "duration_days": 30, "billed": 400_000}), lag=0, weeks=2, today=saturday)
+    assert weekly(fc, "billings") == [6000.0, 0.0]
+
+
+def test_fully_blocked_project_counts_as_overdue():
+    fc = spread_forecast(projects({"duration_days": 2, "non_working_days": '["2026-01-05", "2026-01-06"]'}), lag=0, weeks=2, today=TODAY)
+    assert weekly(fc, "billings") == [10000.0, 0.0]
+
+
+def test_retainage_is_released_after_end_plus_lag():
+    # Billings of $5k/week; collections lag a week, net of 10%, and the $1k retainage lands 7 days after the end date.
+    fc = spread_forecast(projects({"retainage_percent": 10}), lag=7, weeks=5, today=TODAY)
+    assert weekly(fc, "billings") == [5000.0, 5000.0, 0.0, 0.0, 0.0]
+    assert weekly(fc, "collections") == [0.0, 4500.0, 4500.0, 1000.0, 0.0]
+
+
+def test_retainage_beyond_horizon_is_not_collected():
+    fc = spread_forecast(projects({"retainage_percent": 10}), lag=7, weeks=3, today=TODAY)
+    assert fc["collections"].sum() == pytest.approx(9000)
+
+
+def test_future_start_and_overbilled_projects():
+    fc = spread_forecast(projects({"start_date": TODAY + datetime.timedelta(days=14), "duration_days": 7},
+                                  {"billed": 1_500_000}), lag=0, weeks=4, today=TODAY)
+    assert weekly(fc, "billings") == [0.0, 0.0, 10000.0, 0.0]
+
+
+def test_billing_beyond_horizon_is_cut_off():
+    fc = spread_forecast(projects({"duration_days": 28}), lag=0, weeks=2, today=TODAY)
+    assert weekly(fc, "billings") == [2500.0, 2500.0]
+
+
+def test_no_projects():
+    fc = spread_forecast(projects().iloc[0:0], lag=30, weeks=3, today=TODAY)
+    assert len(fc) == 3 and fc["billings"].sum() == 0 and fc["collections"].sum() == 0
+
+
+@pytest.mark.parametrize("value,expected", [
+    ('["2026-01-07"]', ["2026-01-07"]), ("[]", []), (None, []), ("", []), ("{bad", []), ('{"a": 1}', []), (["2026-01-07"], ["2026-01-07"]),
+])
+def test_parse_date_list(value, expected):
+    assert parse_date_list(value) == expected
@@ -0,0 +1,109 @@
+import os
+import random
+from decimal import Decimal
+
+import pytest
+
+from ar_money import to_cents, cents_to_decimal, format_cents, cents_sql
+
+# Deterministic "property" samples: edges plus a seeded spread of magnitudes and signs.
+EDGE_CENTS = [0, 1, -1, 5, 10, 99, 100, 101, -99, -100, 12345, -12345, 100000, 123456789, -987654321, 2 ** 53]
+_rng = random.Random(20260101)
+CENTS = EDGE_CENTS + [_rng.choice((-1, 1)) * _rng.randrange(10 ** _rng.randint(1, 14)) for _ in range(200)]
+
+
+@pytest.mark.parametrize("cents", CENTS)
+def test_format_round_trip(cents):
+    assert to_cents(format_cents(cents)) == cents
+    assert to_cents(format_cents(cents, symbol=False)) == cents
+
+
+@pytest.mark.parametrize("cents", CENTS)
+def test_decimal_round_trip(cents):
+    dec = cents_to_decimal(cents)
+    assert dec == Decimal(cents) / 100
+    assert dec.as_tuple().exponent == -2
+    assert to_cents(dec) == cents
+    assert to_cents(str(dec)) == cents
+
+
+@pytest.mark.parametrize("cents", [c for c in CENTS if abs(c) < 10 ** 13])
+def test_float_round_trip(cents):
+    # Values that came through pandas/JSON as floats must land on the same cent.
+    assert to_cents(float(cents_to_decimal(cents))) == cents
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_sum_is_exact(seed):
+    rng = random.Random(seed)
+    amounts = [rng.randint(-10 ** 9, 10 ** 9) for _ in range(rng.randint(1, 300))]
+    total = sum(amounts)
+    assert sum(to_cents(cents_to_decimal(c)) for c in amounts) == total
+    assert to_cents(sum(cents_to_decimal(c) for c in amounts)) == total
+    assert sum(to_cents(format_cents(c)) for c in amounts) == to_cents(format_cents(total))
+
+
+def test_float_sum_does_not_drift():
+    assert sum(to_cents(v) for v in [0.1] * 10) == 100
+    assert to_cents(0.1) + to_cents(0.2) == to_cents("0.30")
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("1.005", 101), ("1.004", 100), ("-1.005", -101), ("2.675", 268), (2.675, 268),
+    (7, 700), ("$1,234.56", 123456), ("-$1,234.56", -123456), (" 12 ", 1200), (Decimal("0.015"), 2),
+])
+def test_to_cents_rounds_half_up(value, expected):
+    assert to_cents(value) == expected
+
+
+@pytest.mark.parametrize("value", [None, "", "   ", "abc", "$", float("nan")])
+def test_to_cents_bad_input_is_zero(value):
+    assert to_cents(value) == 0
+
+
+@pytest.mark.parametrize("cents,text", [
+    (0, "$0.00"), (5, "$0.05"), (-5, "-$0.05"), (123456789, "$1,234,567.89"), (None, "$0.00"),
+])
+def test_format_cents(cents, text):
+    assert format_cents(cents) == text
+    assert format_cents(cents, symbol=False) == text.replace("$", "")
+
+
+# --- SQL edge: cents_sql must agree with to_cents row by row and in SUMs. Needs a scratch Postgres:
+#     TEST_DATABASE_URL=postgresql://... python -m pytest tests/test_money.py
+@pytest.fixture(scope="module")
+def pg():
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url: pytest.skip("TEST_DATABASE_URL not set")
+    from sqlalchemy import create_engine
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        yield conn
+    engine.dispose()
+
+
+def _amounts(seed):
+    # NUMERIC(14,2) values like the app stores, plus NULLs, and 3-decimal values to exercise ROUND ties.
+    rng = random.Random(seed)
+    values = [Decimal(rng.randint(-10 ** 11, 10 ** 11)) / 100 for _ in range(rng.randint(1, 300))]
+    values += [None, Decimal("0.005"), Decimal("-0.005"), Decimal("2.675"), Decimal("1.004")]
+    return values
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_sql_cents_match_python(pg, seed):
+    from sqlalchemy import text
+    values = _amounts(seed)
+    trans = pg.begin()
+    try:
+        pg.execute(text("CREATE TEMP TABLE money_probe (id SERIAL, amount NUMERIC(14,3)) ON COMMIT DROP"))
+        pg.execute(text("INSERT INTO money_probe (amount) VALUES (:a)"), [{"a": v} for v in values])
+        rows = pg.execute(text(f"SELECT amount, {cents_sql('amount')} FROM money_probe ORDER BY id")).all()
+        assert [cents for _, cents in rows] == [to_cents(v) for v in values]
+        total, = pg.execute(text(f"SELECT SUM({cents_sql('amount')}) FROM money_probe")).one()
+        assert int(total) == sum(to_cents(v) for v in values)
+        # For stored 2-decimal money, summing cents equals converting the dollar SUM once.
+        dollars, cents = pg.execute(text(f"SELECT SUM(amount), SUM({cents_sql('amount')}) FROM money_probe WHERE amount = ROUND(amount, 2)")).one()
+        assert to_cents(dollars or 0) == int(cents or 0)
+    finally:
+        trans.rollback()
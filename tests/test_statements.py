@@ -0,0 +1,118 @@
+import email
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+from ar_jobs import SMTPSender, PermanentDeliveryError, build_statement_message, main
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    # Minimal local SMTP server: stores every message and can answer the end of DATA with queued replies.
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.messages, self.connections, self.data_replies = [], 0, []
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost ready")
+        while True:
+            line = self.rfile.readline()
+            if not line: return
+            verb = line.decode().strip().split(" ")[0].upper()
+            if verb == "EHLO": self.reply("250 localhost")
+            elif verb == "DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                data = []
+                for body in iter(self.rfile.readline, b".\r\n"): data.append(body[1:] if body.startswith(b"..") else body)
+                reply = self.server.data_replies.pop(0) if self.server.data_replies else "250 queued"
+                if reply.startswith("250"): self.server.messages.append(email.message_from_bytes(b"".join(data)))
+                self.reply(reply)
+            elif verb == "QUIT": self.reply("221 bye"); return
+            else: self.reply("250 ok")
+
+
+@pytest.fixture
+def sink():
+    server = SMTPSink()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown(); server.server_close()
+
+
+TENANT = {"company_name": "Acme Builders", "username": "acme", "email": "office@acme.test"}
+
+def message(n=1):
+    return build_statement_message("statements@progressbill.local", TENANT, f"Client {n}", f"client{n}@example.test", "2026-09", 123456, b"%PDF-1.4 test")
+
+def sender_for(server, **kwargs):
+    return SMTPSender("127.0.0.1", server.server_address[1], **{"rate": 0, "backoff": 0, **kwargs})
+
+
+def test_delivers_every_message_over_one_connection(sink):
+    sender = sender_for(sink)
+    assert [sender.send(message(n)) for n in range(5)] == [1] * 5
+    sender.close()
+    assert sink.connections == 1
+    assert [m["To"] for m in sink.messages] == [f"client{n}@example.test" for n in range(5)]
+
+
+def test_message_carries_balance_and_pdf(sink):
+    sender = sender_for(sink)
+    sender.send(message()); sender.close()
+    msg = sink.messages[0]
+    assert msg["Subject"] == "Statement from Acme Builders - 2026-09"
+    assert msg["Reply-To"] == "office@acme.test"
+    body, attachment = [part for part in msg.walk() if not part.is_multipart()]
+    assert "Balance due: $1,234.56" in body.get_payload(decode=True).decode()
+    assert attachment.get_filename() == "Statement_Client 1_2026-09.pdf"
+    assert attachment.get_payload(decode=True) == b"%PDF-1.4 test"
+
+
+def test_transient_failure_is_retried(sink):
+    sink.data_replies = ["451 4.3.0 try again later"]
+    sender = sender_for(sink, retries=3)
+    assert sender.send(message()) == 2
+    sender.close()
+    assert len(sink.messages) == 1
+
+
+def test_permanent_failure_is_not_retried(sink):
+    sink.data_replies = ["550 5.1.1 no such mailbox"]
+    with pytest.raises(PermanentDeliveryError) as err:
+        sender_for(sink, retries=3).send(message())
+    assert err.value.attempts == 1
+    assert not sink.messages
+
+
+def test_unreachable_server_exhausts_retries():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0)); port = s.getsockname()[1]
+    with pytest.raises(PermanentDeliveryError) as err:
+        SMTPSender("127.0.0.1", port, rate=0, retries=2, backoff=0).send(message())
+    assert err.value.attempts == 2
+
+
+def test_rate_limits_sends(sink):
+    sender = sender_for(sink, rate=600)
+    started = time.monotonic()
+    for n in range(3): sender.send(message(n))
+    sender.close()
+    assert time.monotonic() - started >= 0.2
+
+
+def test_retries_must_be_positive():
+    with pytest.raises(ValueError):
+        SMTPSender("127.0.0.1", 25, retries=0)
+    with pytest.raises(SystemExit):
+        main(["statements", "--retries", "0"])